@@ -23,20 +23,81 @@ All responses follow a consistent format:
 """
 
 import os
+
+# Cooperative I/O for direct runs (gunicorn's gevent worker patches on its own)
+if os.environ.get("USE_GEVENT"):
+    from gevent import monkey
+    monkey.patch_all()
+
 import sys
 import json
 import subprocess
-import base64
-import tempfile
+import io
+import hashlib
+import shlex
 import time
 import logging
 import re
+import selectors
+import struct
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from functools import wraps
+from functools import lru_cache, wraps
 from typing import Optional, Dict, Any, List, Tuple
 
 from flask import Flask, request, jsonify, Response, send_file
 
+# SIMD-accelerated base64 when available (drop-in for the stdlib module)
+try:
+    import pybase64 as base64
+except ImportError:
+    import base64
+
+# Optional: raw framebuffer capture with host-side encoding (much faster than
+# on-device `screencap -p`). Falls back to screencap -p when unavailable.
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB
+    _turbojpeg = TurboJPEG()
+except (ImportError, OSError, RuntimeError):
+    _turbojpeg = None
+
+try:
+    import imagecodecs
+except ImportError:
+    imagecodecs = None
+
+# Fast frame hashing for screenshot ETags; blake2b otherwise
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# Fast JSON encoding for large (base64) payloads; stdlib json otherwise
+try:
+    import orjson
+    from flask.json.provider import DefaultJSONProvider
+except ImportError:
+    orjson = None
+
+# Optional: WebSocket input stream (/ws/input)
+try:
+    from flask_sock import Sock
+except ImportError:
+    Sock = None
+
+# Response compression (gzip/brotli) for large JSON bodies
+try:
+    from flask_compress import Compress
+except ImportError:
+    Compress = None
+
 # Configure logging
 LOG_DIR = os.environ.get("LOG_DIR", "/var/log/cloud-phone")
 os.makedirs(LOG_DIR, exist_ok=True)
@@ -53,6 +114,33 @@ logger = logging.getLogger("agent-api")
 
 app = Flask(__name__)
 
+
+if orjson is not None:
+    _ORJSON_OPTS = orjson.OPT_NON_STR_KEYS | orjson.OPT_NAIVE_UTC
+
+    class OrjsonProvider(DefaultJSONProvider):
+        """Flask JSON provider backed by orjson."""
+
+        def dumps(self, obj, **kwargs):
+            return orjson.dumps(obj, option=_ORJSON_OPTS, default=self.default).decode()
+
+        def loads(self, s, **kwargs):
+            return orjson.loads(s)
+
+    app.json = OrjsonProvider(app)
+
+sock = Sock(app) if Sock is not None else None
+
+if Compress is not None:
+    # JSON only (images are already compressed); streamed responses
+    # (screenshots, pulls, file reads) are left as-is
+    app.config.update(
+        COMPRESS_MIMETYPES=["application/json"],
+        COMPRESS_MIN_SIZE=512,
+        COMPRESS_STREAMS=False,
+    )
+    Compress(app)
+
 # =============================================================================
 # Configuration
 # =============================================================================
@@ -62,6 +150,36 @@ ADB_PORT = os.environ.get("ADB_PORT", "5555")
 ADB_TARGET = f"{ADB_HOST}:{ADB_PORT}"
 API_TOKEN = os.environ.get("API_TOKEN", "")
 DEFAULT_TIMEOUT = int(os.environ.get("DEFAULT_TIMEOUT", "30"))
+CONNECTION_TTL = int(os.environ.get("CONNECTION_TTL", "30"))
+# IME that accepts base64 text broadcasts (ADBKeyboard); `input text` otherwise
+ADB_KEYBOARD_IME = os.environ.get("ADB_KEYBOARD_IME", "com.android.adbkeyboard/.AdbIME")
+APPS_CACHE_TTL = int(os.environ.get("APPS_CACHE_TTL", "30"))
+
+# Output parsing patterns
+_RE_GETPROP = re.compile(r"^\[([^\]]+)\]:\s*\[([^\]]*)\]", re.M)  # [key]: [value]
+_RE_SIZE = re.compile(r'(\d+)x(\d+)')
+_RE_DENSITY = re.compile(r'(\d+)')
+_RE_ORIENT = re.compile(r'mCurrentOrientation=(\d)')
+_RE_VERNAME = re.compile(r'versionName=(\S+)')
+_RE_VERCODE = re.compile(r'versionCode=(\d+)')
+_RE_ACT = re.compile(r'([a-zA-Z0-9_.]+)/([a-zA-Z0-9_.]+)')
+_RE_BATT_LEVEL = re.compile(r'level: (\d+)')
+_RE_BATT_STAT = re.compile(r'status: (\d+)')
+_RE_PACKAGE = re.compile(r'^package:(\S+)', re.M)
+_RE_RESUMED = re.compile(r'^\s*mResumedActivity:(.*)$', re.M)
+
+# `input text` escaping in one pass: quote for sh, %s for spaces, escape &
+_INPUT_TEXT_ESCAPE = str.maketrans({"'": "'\\''", " ": "%s", "&": "\\&"})
+
+# Worker pool for independent ADB queries within one request
+_POOL = ThreadPoolExecutor(max_workers=8)
+
+# ADB connection state (skip `adb devices` while known-good)
+_conn_cache = {"ok": False, "ts": 0.0}
+_conn_lock = threading.Lock()
+
+# Stderr fragments that mean the device link is gone
+_DISCONNECT_ERRORS = ("device offline", f"'{ADB_TARGET}' not found", "no devices", "broken pipe")
 
 # Screen dimensions cache
 _screen_cache = {
@@ -69,8 +187,18 @@ _screen_cache = {
     "height": None,
     "density": None,
     "orientation": None,
-    "updated_at": None
+    "updated_at": 0.0  # time.monotonic() of last refresh
 }
+_screen_lock = threading.Lock()
+
+# Last encoded screenshot: ((pixel digest, format, quality, region), image)
+_last_encoded: Tuple[Optional[tuple], Optional[bytes]] = (None, None)
+
+# Shell commands that can change what get_screen_info() reports
+_SCREEN_COMMANDS = ("wm size", "wm density", "rotation")
+
+# Installed packages per list type: (time.monotonic() of fetch, packages)
+_apps_cache = {"user": (0.0, None), "system": (0.0, None), "all": (0.0, None)}
 
 # =============================================================================
 # Helpers
@@ -79,9 +207,13 @@ _screen_cache = {
 def adb(*args, timeout: int = DEFAULT_TIMEOUT) -> Tuple[bool, str, str]:
     """Execute ADB command. Returns (success, stdout, stderr)."""
     cmd = ["adb", "-s", ADB_TARGET] + list(args)
-    logger.debug(f"ADB: {' '.join(cmd)}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("ADB: %s", " ".join(cmd))
     try:
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+        result = subprocess.run(cmd, capture_output=True, text=True,
+                                encoding="utf-8", errors="replace", timeout=timeout)
+        if result.returncode != 0:
+            _check_disconnect(result.stderr)
         return result.returncode == 0, result.stdout.strip(), result.stderr.strip()
     except subprocess.TimeoutExpired:
         logger.error(f"ADB timeout: {cmd}")
@@ -90,17 +222,136 @@ def adb(*args, timeout: int = DEFAULT_TIMEOUT) -> Tuple[bool, str, str]:
         logger.error(f"ADB error: {e}")
         return False, "", str(e)
 
+def _check_disconnect(stderr: str):
+    """Invalidate the cached connection state if stderr reports a lost device."""
+    stderr = stderr.lower()
+    if any(e in stderr for e in _DISCONNECT_ERRORS):
+        _conn_cache["ok"] = False
+
+class AdbSession:
+    """
+    Persistent `adb shell` that runs commands without spawning adb per call.
+    
+    Each command is followed by a unique marker echoed to stdout (with the exit
+    code) and stderr, so output can be framed on the shared pipes. The shell is
+    respawned on EOF, broken pipe or timeout.
+    """
+    
+    def __init__(self, target: str):
+        self.target = target
+        self.proc = None
+        self.lock = threading.Lock()
+    
+    def alive(self) -> bool:
+        return self.proc is not None and self.proc.poll() is None
+    
+    def close(self):
+        if self.proc:
+            try:
+                self.proc.kill()
+                self.proc.wait(timeout=5)
+            except Exception:
+                pass
+        self.proc = None
+    
+    def _spawn(self):
+        self.close()
+        self.proc = subprocess.Popen(
+            ["adb", "-s", self.target, "shell"],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            bufsize=0
+        )
+        logger.info(f"ADB shell session started (pid={self.proc.pid})")
+    
+    def _read_until(self, marker: bytes, timeout: float) -> Tuple[bytes, bytes, int]:
+        """Read stdout/stderr until both carry the marker. Returns (stdout, stderr, rc)."""
+        deadline = time.monotonic() + timeout
+        bufs = {self.proc.stdout.fileno(): bytearray(), self.proc.stderr.fileno(): bytearray()}
+        out_fd, err_fd = self.proc.stdout.fileno(), self.proc.stderr.fileno()
+        pending = set(bufs)
+        
+        with selectors.DefaultSelector() as sel:
+            for fd in bufs:
+                sel.register(fd, selectors.EVENT_READ)
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError
+                for key, _ in sel.select(remaining):
+                    chunk = os.read(key.fd, 65536)
+                    if not chunk:
+                        raise EOFError
+                    buf = bufs[key.fd]
+                    buf += chunk
+                    idx = buf.find(marker)
+                    if idx != -1 and buf.find(b"\n", idx) != -1:
+                        pending.discard(key.fd)
+                        sel.unregister(key.fd)
+        
+        out, err = bufs[out_fd], bufs[err_fd]
+        idx = out.find(marker)
+        rc = int(out[idx + len(marker):out.find(b"\n", idx)] or b"1")
+        return bytes(out[:idx]), bytes(err[:err.find(marker)]), rc
+    
+    def run(self, command: str, timeout: int = DEFAULT_TIMEOUT) -> Tuple[bool, str, str]:
+        """Run a shell command. Returns (success, stdout, stderr)."""
+        # Session busy (e.g. a long wait): don't queue behind it
+        if not self.lock.acquire(blocking=False):
+            return adb("shell", command, timeout=timeout)
+        try:
+            if not self.alive():
+                self._spawn()
+            marker = f"__END_{uuid.uuid4().hex}__"
+            # Subshell: `exit`, `cd` or exported vars don't leak into later commands
+            script = f"( {command}\n) </dev/null; echo {marker}$?; echo {marker} >&2\n"
+            self.proc.stdin.write(script.encode())
+            out, err, rc = self._read_until(marker.encode(), timeout)
+            err = err.decode("utf-8", errors="replace").strip()
+            if rc != 0:
+                _check_disconnect(err)
+            return rc == 0, out.decode("utf-8", errors="replace").strip(), err
+        except TimeoutError:
+            logger.error(f"ADB shell timeout: {command}")
+            self.close()
+            return False, "", "Command timed out"
+        except (EOFError, OSError) as e:
+            logger.warning(f"ADB shell session lost ({type(e).__name__}); respawning on next call")
+            self.close()
+            _conn_cache["ok"] = False
+            return False, "", "ADB shell session closed"
+        except Exception as e:
+            logger.error(f"ADB shell error: {e}")
+            self.close()
+            return False, "", str(e)
+        finally:
+            self.lock.release()
+
+_session = AdbSession(ADB_TARGET)
+
 def adb_shell(command: str, timeout: int = DEFAULT_TIMEOUT) -> Tuple[bool, str, str]:
-    """Execute ADB shell command."""
-    return adb("shell", command, timeout=timeout)
+    """Execute ADB shell command over the persistent session."""
+    return _session.run(command, timeout)
 
 def ensure_connected() -> bool:
-    """Ensure ADB connection is established."""
-    success, out, _ = adb("devices")
-    if ADB_TARGET in out and "device" in out:
+    """Ensure ADB connection is established (cached for CONNECTION_TTL seconds)."""
+    if _conn_cache["ok"] and time.monotonic() - _conn_cache["ts"] < CONNECTION_TTL:
         return True
-    success, out, _ = adb("connect", ADB_TARGET)
-    return "connected" in out.lower()
+    
+    # One probe at a time; requests that queued behind it reuse its result
+    with _conn_lock:
+        if _conn_cache["ok"] and time.monotonic() - _conn_cache["ts"] < CONNECTION_TTL:
+            return True
+        
+        success, out, _ = adb("devices")
+        # "<serial>\tdevice" (the header line also contains "device")
+        connected = any(line.split() == [ADB_TARGET, "device"] for line in out.splitlines())
+        if not connected:
+            success, out, _ = adb("connect", ADB_TARGET)
+            connected = "connected" in out.lower()
+        
+        _conn_cache["ok"] = connected
+        _conn_cache["ts"] = time.monotonic()
+    return connected
 
 def api_response(success: bool, data: Any = None, error: str = None) -> Dict:
     """Standard API response format."""
@@ -111,15 +362,19 @@ def api_response(success: bool, data: Any = None, error: str = None) -> Dict:
         "timestamp": datetime.utcnow().isoformat() + "Z"
     }
 
+def is_authorized() -> bool:
+    """Check the request's bearer token (always true without API_TOKEN)."""
+    if not API_TOKEN:
+        return True
+    return request.headers.get("Authorization", "").replace("Bearer ", "") == API_TOKEN
+
 def require_auth(f):
     """Authentication decorator."""
     @wraps(f)
     def decorated(*args, **kwargs):
-        if API_TOKEN:
-            token = request.headers.get("Authorization", "").replace("Bearer ", "")
-            if token != API_TOKEN:
-                logger.warning(f"Unauthorized request to {request.path}")
-                return jsonify(api_response(False, error="Unauthorized")), 401
+        if not is_authorized():
+            logger.warning(f"Unauthorized request to {request.path}")
+            return jsonify(api_response(False, error="Unauthorized")), 401
         return f(*args, **kwargs)
     return decorated
 
@@ -127,7 +382,7 @@ def log_request(f):
     """Log all requests."""
     @wraps(f)
     def decorated(*args, **kwargs):
-        logger.info(f"{request.method} {request.path} - {request.remote_addr}")
+        logger.info("%s %s - %s", request.method, request.path, request.remote_addr)
         try:
             result = f(*args, **kwargs)
             return result
@@ -144,50 +399,206 @@ def get_screen_info(force_refresh: bool = False) -> Dict:
     """Get screen dimensions and orientation."""
     global _screen_cache
     
-    # Return cached if fresh (< 60 seconds)
-    if not force_refresh and _screen_cache["updated_at"]:
-        age = (datetime.utcnow() - _screen_cache["updated_at"]).seconds
-        if age < 60 and _screen_cache["width"]:
-            return _screen_cache
-    
-    # Get screen size
-    success, out, _ = adb_shell("wm size")
-    if success and "Physical size:" in out:
-        match = re.search(r'(\d+)x(\d+)', out)
-        if match:
-            _screen_cache["width"] = int(match.group(1))
-            _screen_cache["height"] = int(match.group(2))
+    def is_fresh() -> bool:
+        if force_refresh or not _screen_cache["width"]:
+            return False
+        return time.monotonic() - _screen_cache["updated_at"] < 60
     
-    # Get density
-    success, out, _ = adb_shell("wm density")
-    if success and "Physical density:" in out:
-        match = re.search(r'(\d+)', out)
-        if match:
-            _screen_cache["density"] = int(match.group(1))
+    # Return cached if fresh (< 60 seconds)
+    if is_fresh():
+        return _screen_cache
     
-    # Get orientation (0=portrait, 1=landscape, 2=reverse portrait, 3=reverse landscape)
-    success, out, _ = adb_shell("dumpsys display | grep mCurrentOrientation")
-    if success:
-        match = re.search(r'mCurrentOrientation=(\d)', out)
+    # One refresh at a time; concurrent callers reuse its result
+    with _screen_lock:
+        if is_fresh():
+            return _screen_cache
+        
+        # Size, density and orientation in one shell round-trip
+        _, out, _ = adb_shell("wm size; echo ---; wm density; echo ---; "
+                              "dumpsys display | grep -m1 mCurrentOrientation")
+        size_out, density_out, orient_out = (out.split("---") + ["", "", ""])[:3]
+        
+        # Screen size
+        if "Physical size:" in size_out:
+            match = _RE_SIZE.search(size_out)
+            if match:
+                width, height = int(match.group(1)), int(match.group(2))
+                if (width, height) != (_screen_cache["width"], _screen_cache["height"]):
+                    _pct_to_px.cache_clear()
+                _screen_cache["width"] = width
+                _screen_cache["height"] = height
+        
+        # Density
+        if "Physical density:" in density_out:
+            match = _RE_DENSITY.search(density_out)
+            if match:
+                _screen_cache["density"] = int(match.group(1))
+        
+        # Orientation (0=portrait, 1=landscape, 2=reverse portrait, 3=reverse landscape)
+        match = _RE_ORIENT.search(orient_out)
         if match:
             _screen_cache["orientation"] = int(match.group(1))
-    
-    _screen_cache["updated_at"] = datetime.utcnow()
+        
+        _screen_cache["updated_at"] = time.monotonic()
     return _screen_cache
 
+# =============================================================================
+# Screenshot Capture
+# =============================================================================
+
+def _can_encode(fmt: str) -> bool:
+    """Check whether the raw framebuffer path can produce the given format."""
+    if np is None:
+        return False
+    if fmt == "jpeg":
+        return _turbojpeg is not None
+    return imagecodecs is not None
+
+def _read_framebuffer() -> Optional[Tuple[memoryview, int, int]]:
+    """Raw `screencap` output as (RGBA pixel bytes, width, height)."""
+    result = subprocess.run(
+        ["adb", "-s", ADB_TARGET, "exec-out", "screencap"],
+        capture_output=True,
+        timeout=30
+    )
+    buf = result.stdout
+    if result.returncode != 0 or len(buf) < 12:
+        return None
+    
+    # Header is width, height, format (uint32 LE); Android 8+ appends a colorspace word
+    width, height, _ = struct.unpack("<III", buf[:12])
+    header_size = len(buf) - width * height * 4
+    if header_size not in (12, 16):
+        logger.error(f"Unexpected screencap payload: {len(buf)} bytes for {width}x{height}")
+        return None
+    return memoryview(buf)[header_size:], width, height
+
+def _to_rgb(pixels: memoryview, width: int, height: int) -> "np.ndarray":
+    """View RGBA framebuffer bytes as an RGB array of shape (height, width, 3)."""
+    return np.frombuffer(pixels, dtype=np.uint8).reshape(height, width, 4)[:, :, :3]
+
+def capture_frame() -> Optional["np.ndarray"]:
+    """Capture the raw framebuffer as an RGB array of shape (height, width, 3)."""
+    raw = _read_framebuffer()
+    return _to_rgb(*raw) if raw is not None else None
+
+def _digest(data) -> str:
+    """Short content hash used for screenshot ETags."""
+    if xxhash is not None:
+        return xxhash.xxh3_64_hexdigest(data)
+    return hashlib.blake2b(data, digest_size=8).hexdigest()
+
+def encode_frame(frame: "np.ndarray", fmt: str = "png", quality: int = 80) -> bytes:
+    """Encode an RGB frame as JPEG (libjpeg-turbo) or PNG (fast zlib level)."""
+    frame = np.ascontiguousarray(frame)
+    if fmt == "jpeg":
+        return _turbojpeg.encode(frame, quality=quality, pixel_format=TJPF_RGB)
+    return imagecodecs.png_encode(frame, level=1)
+
+def capture_screenshot(fmt: str = "png", quality: int = 80,
+                       region: Optional[Tuple[int, int, int, int]] = None
+                       ) -> Tuple[Optional[bytes], str, bool, Optional[str]]:
+    """
+    Capture an encoded screenshot, optionally cropped to region (x, y, w, h).
+    
+    Returns (image_bytes, actual_format, cropped, etag). Falls back to
+    on-device `screencap -p` (full-frame PNG) when the raw path is unavailable.
+    An unchanged frame reuses the previous encoding instead of re-encoding.
+    """
+    global _last_encoded
+    fmt = "jpeg" if fmt in ("jpeg", "jpg") else "png"
+    
+    if _can_encode(fmt):
+        raw = _read_framebuffer()
+        if raw is not None:
+            key = (_digest(raw[0]), fmt, quality, region)
+            etag = _digest(repr(key).encode())
+            cached_key, cached = _last_encoded
+            if cached_key == key:
+                return cached, fmt, bool(region), etag
+            frame = _to_rgb(*raw)
+            if region:
+                x, y, w, h = region
+                frame = frame[y:y + h, x:x + w]
+            image = encode_frame(frame, fmt, quality)
+            _last_encoded = (key, image)
+            return image, fmt, bool(region), etag
+    
+    result = subprocess.run(
+        ["adb", "-s", ADB_TARGET, "exec-out", "screencap", "-p"],
+        capture_output=True,
+        timeout=30
+    )
+    if result.returncode != 0 or not result.stdout:
+        return None, "png", False, None
+    return result.stdout, "png", False, _digest(result.stdout)
+
 def convert_coordinates(x: float, y: float, as_percentage: bool = False) -> Tuple[int, int]:
     """Convert coordinates. If as_percentage=True, x/y are 0-100 percentages."""
-    screen = get_screen_info()
-    
     if as_percentage:
-        # Convert percentage to pixels
-        px_x = int((x / 100.0) * screen["width"])
-        px_y = int((y / 100.0) * screen["height"])
-        return px_x, px_y
+        # Convert percentage to pixels (quantized to 0.1% so repeats hit the cache);
+        # only this path needs the screen size
+        screen = get_screen_info()
+        return _pct_to_px(int(x * 10), int(y * 10), screen["width"], screen["height"])
     else:
         # Already pixels, ensure integers
         return int(x), int(y)
 
+@lru_cache(maxsize=4096)
+def _pct_to_px(x_q: int, y_q: int, width: int, height: int) -> Tuple[int, int]:
+    """Pixel position for a percentage given in tenths of a percent."""
+    return int(x_q * width / 1000), int(y_q * height / 1000)
+
+def input_action_commands(actions: List[Dict], as_percentage: bool = False) -> List[str]:
+    """
+    Build shell commands for /input/batch-style actions.
+    
+    Raises ValueError ("actions[i]: ...") for an unknown or malformed action.
+    """
+    commands = []
+    for i, act in enumerate(actions):
+        try:
+            kind = act.get("action")
+            if kind == "tap":
+                x, y = convert_coordinates(act.get("x", 0), act.get("y", 0), as_percentage)
+                commands.append(f"input tap {x} {y}")
+            elif kind in ("swipe", "long_press"):
+                if kind == "swipe":
+                    x1, y1 = convert_coordinates(act.get("x1", 0), act.get("y1", 0), as_percentage)
+                    x2, y2 = convert_coordinates(act.get("x2", 0), act.get("y2", 0), as_percentage)
+                    duration = int(act.get("duration", 300))
+                else:
+                    x1, y1 = x2, y2 = convert_coordinates(act.get("x", 0), act.get("y", 0), as_percentage)
+                    duration = int(act.get("duration", 1000))
+                commands.append(f"input swipe {x1} {y1} {x2} {y2} {duration}")
+            elif kind == "key":
+                commands.append(f"input keyevent {shlex.quote(str(act.get('key', '')))}")
+            elif kind == "text":
+                commands.append(input_text_command(str(act.get("text", ""))))
+            elif kind == "wait":
+                commands.append(f"sleep {int(act.get('ms', 0)) / 1000:.3f}")
+            else:
+                raise ValueError(f"unknown action '{kind}'")
+        except (AttributeError, TypeError, ValueError) as e:
+            raise ValueError(f"actions[{i}]: {e}") from None
+    return commands
+
+def input_text_command(text: str) -> str:
+    """
+    Build a shell command that types text.
+    
+    Uses a single base64 broadcast when ADBKeyboard is the active IME
+    (any length, no escaping), otherwise falls back to `input text`.
+    """
+    b64 = base64.b64encode(text.encode()).decode()
+    # Basic Latin only on this path; ADBKeyboard handles everything else
+    escaped = text.translate(_INPUT_TEXT_ESCAPE)
+    return (
+        f"if [ \"$(settings get secure default_input_method)\" = '{ADB_KEYBOARD_IME}' ]; "
+        f"then am broadcast -a ADB_INPUT_B64 --es msg '{b64}' >/dev/null; "
+        f"else input text '{escaped}'; fi"
+    )
+
 # =============================================================================
 # API Endpoints: Screen
 # =============================================================================
@@ -226,12 +637,17 @@ def screenshot():
     Capture screenshot.
     
     Query params:
-        format: "png" (default), "base64", "jpeg"
+        format: "png" (default), "base64", "jpeg", "raw"
         quality: JPEG quality 1-100 (default: 80)
     
     Returns:
         format=png/jpeg: Binary image data
         format=base64: {"image": "base64string", "width": 1080, "height": 2400}
+        format=raw: RGB888 pixel buffer (application/octet-stream) with
+                    X-Width/X-Height headers
+    
+    PNG/JPEG responses carry an ETag; send it back as If-None-Match to get
+    304 Not Modified while the screen is unchanged.
     
     Example:
         GET /screen/screenshot?format=base64
@@ -240,27 +656,35 @@ def screenshot():
     fmt = request.args.get("format", "png").lower()
     quality = int(request.args.get("quality", "80"))
     
-    # Capture screenshot
-    result = subprocess.run(
-        ["adb", "-s", ADB_TARGET, "exec-out", "screencap", "-p"],
-        capture_output=True,
-        timeout=30
-    )
-    
-    if result.returncode != 0 or not result.stdout:
+    if fmt == "raw":
+        if np is None:
+            return jsonify(api_response(False, error="format=raw requires numpy")), 501
+        frame = capture_frame()
+        if frame is None:
+            return jsonify(api_response(False, error="Failed to capture screenshot")), 500
+        return Response(frame.tobytes(), mimetype="application/octet-stream", headers={
+            "X-Width": str(frame.shape[1]),
+            "X-Height": str(frame.shape[0])
+        })
+    
+    # Capture screenshot (base64 is PNG-encoded, as before)
+    image, image_fmt, _, etag = capture_screenshot("png" if fmt == "base64" else fmt, quality)
+    
+    if not image:
         return jsonify(api_response(False, error="Failed to capture screenshot")), 500
     
-    screen = get_screen_info()
-    
     if fmt == "base64":
+        screen = get_screen_info()
         return jsonify(api_response(True, data={
-            "image": base64.b64encode(result.stdout).decode(),
-            "format": "png",
+            "image": base64.b64encode(image).decode(),
+            "format": image_fmt,
             "width": screen["width"],
             "height": screen["height"]
         }))
     else:
-        return Response(result.stdout, mimetype=f"image/{fmt}")
+        # Pollers sending If-None-Match get a 304 while the screen is unchanged
+        return send_file(io.BytesIO(image), mimetype=f"image/{image_fmt}",
+                         conditional=True, etag=etag or False)
 
 @app.route("/screen/screenshot/region", methods=["POST"])
 @log_request
@@ -278,12 +702,19 @@ def screenshot_region():
             "percentage": false  // If true, all values are percentages (0-100)
         }
     
+    Query params:
+        format: "png" (default) or "jpeg"
+        quality: JPEG quality 1-100 (default: 80)
+    
     Returns:
-        {"image": "base64string", "x": 100, "y": 200, "width": 300, "height": 400}
+        {"image": "base64string", "format": "png", "x": 100, "y": 200, "width": 300, "height": 400}
     """
     data = request.get_json() or {}
     is_pct = data.get("percentage", False)
+    fmt = request.args.get("format", "png").lower()
+    quality = int(request.args.get("quality", "80"))
     
+    ensure_connected()
     screen = get_screen_info()
     
     if is_pct:
@@ -297,22 +728,30 @@ def screenshot_region():
         w = int(data.get("width", screen["width"]))
         h = int(data.get("height", screen["height"]))
     
-    # For now, capture full screen - region cropping would need PIL
-    # This is a simplified version
-    result = subprocess.run(
-        ["adb", "-s", ADB_TARGET, "exec-out", "screencap", "-p"],
-        capture_output=True,
-        timeout=30
-    )
+    if x < 0 or y < 0:
+        return jsonify(api_response(False, error="x and y must not be negative")), 400
     
-    if result.returncode != 0:
+    # Clamp region to the screen
+    if screen["width"] and screen["height"]:
+        w = min(w, screen["width"] - x)
+        h = min(h, screen["height"] - y)
+    if w <= 0 or h <= 0:
+        return jsonify(api_response(False, error="Region is empty or outside the screen")), 400
+    
+    image, image_fmt, cropped, _ = capture_screenshot(fmt, quality, region=(x, y, w, h))
+    
+    if not image:
         return jsonify(api_response(False, error="Failed to capture screenshot")), 500
     
-    return jsonify(api_response(True, data={
-        "image": base64.b64encode(result.stdout).decode(),
-        "x": x, "y": y, "width": w, "height": h,
-        "note": "Full screenshot returned; client should crop to specified region"
-    }))
+    result = {
+        "image": base64.b64encode(image).decode(),
+        "format": image_fmt,
+        "x": x, "y": y, "width": w, "height": h
+    }
+    if not cropped:
+        result["note"] = "Full screenshot returned; client should crop to specified region"
+    
+    return jsonify(api_response(True, data=result))
 
 # =============================================================================
 # API Endpoints: Input
@@ -347,7 +786,7 @@ def input_tap():
     ensure_connected()
     success, out, err = adb_shell(f"input tap {x} {y}")
     
-    logger.info(f"Tap at ({x}, {y}) - success={success}")
+    logger.info("Tap at (%s, %s) - success=%s", x, y, success)
     
     return jsonify(api_response(success, 
         data={"x": x, "y": y, "action": "tap"},
@@ -388,7 +827,7 @@ def input_swipe():
     ensure_connected()
     success, out, err = adb_shell(f"input swipe {x1} {y1} {x2} {y2} {duration}")
     
-    logger.info(f"Swipe ({x1},{y1}) -> ({x2},{y2}) duration={duration}ms - success={success}")
+    logger.info("Swipe (%s,%s) -> (%s,%s) duration=%sms - success=%s", x1, y1, x2, y2, duration, success)
     
     return jsonify(api_response(success,
         data={"x1": x1, "y1": y1, "x2": x2, "y2": y2, "duration": duration, "action": "swipe"},
@@ -423,7 +862,7 @@ def input_long_press():
     # Long press is a swipe to the same position
     success, out, err = adb_shell(f"input swipe {x} {y} {x} {y} {duration}")
     
-    logger.info(f"Long press at ({x},{y}) duration={duration}ms - success={success}")
+    logger.info("Long press at (%s,%s) duration=%sms - success=%s", x, y, duration, success)
     
     return jsonify(api_response(success,
         data={"x": x, "y": y, "duration": duration, "action": "long_press"},
@@ -443,7 +882,9 @@ def input_text():
             "clear_first": false  // If true, clear field before typing
         }
     
-    Note: Special characters may not work. Use input/key for special keys.
+    Note: With ADBKeyboard as the active IME any text (unicode, long strings)
+    is sent in one broadcast; otherwise special characters may not work.
+    Use input/key for special keys.
     
     Returns:
         {"success": true, "data": {"text": "Hello World", "length": 11}}
@@ -459,11 +900,9 @@ def input_text():
         adb_shell("input keyevent KEYCODE_CTRL_A")
         adb_shell("input keyevent KEYCODE_DEL")
     
-    # Escape special characters for shell
-    escaped = text.replace("'", "'\\''").replace(" ", "%s").replace("&", "\\&")
-    success, out, err = adb_shell(f"input text '{escaped}'")
+    success, out, err = adb_shell(input_text_command(text))
     
-    logger.info(f"Input text: '{text[:20]}...' ({len(text)} chars) - success={success}")
+    logger.info("Input text: '%.20s...' (%d chars) - success=%s", text, len(text), success)
     
     return jsonify(api_response(success,
         data={"text": text, "length": len(text), "action": "text"},
@@ -496,13 +935,106 @@ def input_key():
     ensure_connected()
     success, out, err = adb_shell(f"input keyevent {key}")
     
-    logger.info(f"Key event: {key} - success={success}")
+    logger.info("Key event: %s - success=%s", key, success)
     
     return jsonify(api_response(success,
         data={"key": key, "action": "key"},
         error=err if not success else None
     ))
 
+@app.route("/input/batch", methods=["POST"])
+@log_request
+@require_auth
+def input_batch():
+    """
+    Run several input actions in one device round-trip.
+    
+    Body:
+        {
+            "actions": [
+                {"action": "tap", "x": 50, "y": 40},
+                {"action": "text", "text": "hello"},
+                {"action": "key", "key": "KEYCODE_ENTER"},
+                {"action": "wait", "ms": 500},
+                {"action": "swipe", "x1": 50, "y1": 75, "x2": 50, "y2": 25, "duration": 300},
+                {"action": "long_press", "x": 50, "y": 50, "duration": 1000}
+            ],
+            "percentage": false  // If true, coordinates are percentages
+        }
+    
+    Actions run in order and stop at the first failure.
+    
+    Returns:
+        {"success": true, "data": {"count": 6, "actions": [...]}}
+    """
+    data = request.get_json() or {}
+    actions = data.get("actions") or []
+    is_pct = data.get("percentage", False)
+    
+    if not isinstance(actions, list) or not actions:
+        return jsonify(api_response(False, error="actions list required")), 400
+    
+    try:
+        commands = input_action_commands(actions, is_pct)
+    except ValueError as e:
+        return jsonify(api_response(False, error=str(e))), 400
+    
+    ensure_connected()
+    success, out, err = adb_shell(" && ".join(commands), timeout=DEFAULT_TIMEOUT + len(commands))
+    
+    logger.info("Input batch: %d actions - success=%s", len(commands), success)
+    
+    return jsonify(api_response(success,
+        data={"count": len(commands), "actions": actions, "action": "batch"},
+        error=err if not success else None
+    ))
+
+if sock is not None:
+    @sock.route("/ws/input")
+    def ws_input(ws):
+        """
+        Stream input actions over one WebSocket (requires flask-sock).
+        
+        Each message is one action or a list of actions, in the /input/batch
+        format, optionally wrapped as {"actions": [...], "percentage": true}.
+        Each message runs as one command on the persistent shell and gets a
+        reply:
+            {"success": true, "data": {"count": 1}, "error": null, ...}
+        """
+        if not is_authorized():
+            logger.warning("Unauthorized request to %s", request.path)
+            ws.close(reason=1008, message="Unauthorized")
+            return
+        
+        count = 0
+        try:
+            while True:
+                message = ws.receive()
+                if message is None:
+                    break
+                try:
+                    data = app.json.loads(message)
+                    if isinstance(data, dict) and "actions" in data:
+                        actions, is_pct = data["actions"], data.get("percentage", False)
+                    else:
+                        actions, is_pct = data if isinstance(data, list) else [data], False
+                    commands = input_action_commands(actions, is_pct)
+                    if not commands:
+                        raise ValueError("actions list required")
+                except ValueError as e:
+                    ws.send(app.json.dumps(api_response(False, error=str(e))))
+                    continue
+                
+                ensure_connected()
+                success, _, err = adb_shell(" && ".join(commands), timeout=DEFAULT_TIMEOUT + len(commands))
+                count += len(commands)
+                ws.send(app.json.dumps(api_response(success,
+                    data={"count": len(commands)},
+                    error=err if not success else None
+                )))
+        finally:
+            logger.info("Input stream closed: %d actions", count)
+
 # Common key shortcuts
 @app.route("/input/back", methods=["POST"])
 @log_request
@@ -544,17 +1076,27 @@ def list_apps():
     
     Query params:
         type: "all", "user" (default), "system"
+        refresh: "true" to bypass the package list cache
     
     Returns:
         {"packages": ["com.example.app", ...], "count": 10}
     """
-    ensure_connected()
     app_type = request.args.get("type", "user")
+    if app_type not in _apps_cache:
+        app_type = "system"
+    refresh = request.args.get("refresh", "false").lower() == "true"
+    
+    ts, packages = _apps_cache[app_type]
+    if not refresh and packages is not None and time.monotonic() - ts < APPS_CACHE_TTL:
+        return jsonify(api_response(True, data={"packages": packages, "count": len(packages)}))
     
+    ensure_connected()
     flag = "-3" if app_type == "user" else "" if app_type == "all" else "-s"
     success, out, err = adb_shell(f"pm list packages {flag}")
     
-    packages = [line.replace("package:", "") for line in out.split("\n") if line.startswith("package:")]
+    packages = _RE_PACKAGE.findall(out)
+    if success:
+        _apps_cache[app_type] = (time.monotonic(), packages)
     
     return jsonify(api_response(success,
         data={"packages": packages, "count": len(packages)},
@@ -586,7 +1128,7 @@ def launch_app(package):
         # Fallback to monkey
         success, _, err = adb_shell(f"monkey -p {package} -c android.intent.category.LAUNCHER 1")
     
-    logger.info(f"Launch app: {package} - success={success}")
+    logger.info("Launch app: %s - success=%s", package, success)
     
     return jsonify(api_response(success,
         data={"package": package, "launched": success},
@@ -606,7 +1148,7 @@ def close_app(package):
     ensure_connected()
     success, _, err = adb_shell(f"am force-stop {package}")
     
-    logger.info(f"Close app: {package} - success={success}")
+    logger.info("Close app: %s - success=%s", package, success)
     
     return jsonify(api_response(success,
         data={"package": package, "closed": success},
@@ -630,12 +1172,12 @@ def app_info(package):
     
     if success:
         # Parse version
-        version_match = re.search(r'versionName=([^\s]+)', out)
+        version_match = _RE_VERNAME.search(out)
         if version_match:
             info["version"] = version_match.group(1)
         
         # Parse version code
-        code_match = re.search(r'versionCode=(\d+)', out)
+        code_match = _RE_VERCODE.search(out)
         if code_match:
             info["version_code"] = int(code_match.group(1))
     
@@ -652,13 +1194,14 @@ def current_app():
         {"package": "com.example", "activity": "MainActivity"}
     """
     ensure_connected()
-    success, out, _ = adb_shell("dumpsys activity activities | grep mResumedActivity")
+    success, out, _ = adb_shell("dumpsys activity activities")
+    resumed = _RE_RESUMED.search(out) if success else None
     
     data = {"package": None, "activity": None}
     
-    if success and out:
+    if resumed:
         # Parse: mResumedActivity: ActivityRecord{... com.package/.Activity ...}
-        match = re.search(r'([a-zA-Z0-9_.]+)/([a-zA-Z0-9_.]+)', out)
+        match = _RE_ACT.search(resumed.group(1))
         if match:
             data["package"] = match.group(1)
             data["activity"] = match.group(2)
@@ -685,17 +1228,22 @@ def list_files():
     ensure_connected()
     path = request.args.get("path", "/sdcard")
     
-    success, out, err = adb_shell(f"ls -la '{path}'")
+    # NUL-terminated type|size|name records: names may contain spaces, "|"
+    # (split at most twice) or newlines
+    success, out, err = adb_shell(
+        f"find {shlex.quote(path)} -maxdepth 1 -mindepth 1 -printf '%y|%s|%f\\0'"
+    )
     
     files = []
     if success:
-        for line in out.split("\n")[1:]:  # Skip "total" line
-            parts = line.split()
-            if len(parts) >= 8:
-                name = " ".join(parts[7:])
-                file_type = "directory" if parts[0].startswith("d") else "file"
-                size = int(parts[4]) if parts[4].isdigit() else 0
-                files.append({"name": name, "type": file_type, "size": size})
+        for record in out.split("\0"):
+            parts = record.split("|", 2)
+            # Skip anything that isn't a whole record (e.g. truncated output)
+            if len(parts) != 3 or not parts[1].isdigit():
+                continue
+            kind, size, name = parts
+            files.append({"name": name, "type": "directory" if kind == "d" else "file",
+                          "size": int(size)})
     
     return jsonify(api_response(success,
         data={"path": path, "files": files, "count": len(files)},
@@ -723,32 +1271,97 @@ def read_file():
     if not path:
         return jsonify(api_response(False, error="path parameter required")), 400
     
-    with tempfile.NamedTemporaryFile(delete=False) as tmp:
-        success, _, err = adb("pull", path, tmp.name)
-        
-        if success and os.path.exists(tmp.name):
-            with open(tmp.name, "rb") as f:
-                content = f.read()
-            os.unlink(tmp.name)
-            
-            if encoding == "base64":
-                return jsonify(api_response(True, data={
-                    "path": path,
-                    "content": base64.b64encode(content).decode(),
-                    "encoding": "base64",
-                    "size": len(content)
-                }))
-            else:
-                return jsonify(api_response(True, data={
-                    "path": path,
-                    "content": content.decode("utf-8", errors="replace"),
-                    "encoding": "text",
-                    "size": len(content)
-                }))
-        
-        os.unlink(tmp.name) if os.path.exists(tmp.name) else None
+    # Stream straight from the device; existence check keeps errors out of the content
+    quoted = shlex.quote(path)
+    exists, _, _ = adb_shell(f"[ -f {quoted} ] && [ -r {quoted} ]")
+    if not exists:
+        return jsonify(api_response(False, error="File not found")), 404
+    
+    if encoding == "base64":
+        return Response(stream_file_base64(path), mimetype="application/json")
+    
+    try:
+        proc = subprocess.Popen(
+            ["adb", "-s", ADB_TARGET, "exec-out", "cat", quoted],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        content, err = proc.communicate(timeout=DEFAULT_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.communicate()
+        return jsonify(api_response(False, error="Command timed out")), 504
+    
+    if proc.returncode != 0:
+        return jsonify(api_response(False, error=err.decode(errors="replace").strip() or "File not found")), 404
     
-    return jsonify(api_response(False, error=err or "File not found")), 404
+    return jsonify(api_response(True, data={
+        "path": path,
+        "content": content.decode("utf-8", errors="replace"),
+        "encoding": "text",
+        "size": len(content)
+    }))
+
+# Multiple of 3 so each chunk base64-encodes without padding
+_B64_CHUNK = 57 * 1024
+
+def stream_file_base64(path: str):
+    """
+    Yield a base64 /files/read JSON response while the file streams off the device.
+    
+    Only one chunk is held in memory. The envelope fields follow the content
+    so success/error reflect how the transfer actually ended. The transfer is
+    killed when the device sends nothing for DEFAULT_TIMEOUT seconds; time
+    spent waiting on a slow client doesn't count.
+    """
+    proc = subprocess.Popen(
+        ["adb", "-s", ADB_TARGET, "exec-out", "cat", shlex.quote(path)],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    reading_since = [None]  # time.monotonic() while blocked on the device
+    done = threading.Event()
+
+    def watchdog():
+        while not done.wait(1.0):
+            since = reading_since[0]
+            if since is not None and time.monotonic() - since > DEFAULT_TIMEOUT:
+                proc.kill()
+                return
+
+    threading.Thread(target=watchdog, daemon=True).start()
+    size, rest = 0, b""
+    try:
+        yield b'{"data":{"path":' + app.json.dumps(path).encode() + b',"encoding":"base64","content":"'
+        while True:
+            # read1: whatever has arrived, so any data resets the idle clock
+            reading_since[0] = time.monotonic()
+            chunk = proc.stdout.read1(_B64_CHUNK)
+            reading_since[0] = None
+            if not chunk:
+                break
+            size += len(chunk)
+            # Encode whole 3-byte groups only: padding mid-string would corrupt it
+            chunk = rest + chunk
+            cut = len(chunk) - len(chunk) % 3
+            rest = chunk[cut:]
+            yield base64.b64encode(chunk[:cut])
+        yield base64.b64encode(rest)
+        err = proc.stderr.read()
+        rc = proc.wait()
+    finally:
+        done.set()
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+    
+    if rc == 0:
+        error = None
+    elif rc < 0:
+        error = "Command timed out"
+    else:
+        error = err.decode(errors="replace").strip() or f"cat exited with {rc}"
+    envelope = api_response(rc == 0, error=error)
+    del envelope["data"]
+    yield b'","size":' + str(size).encode() + b"}," + app.json.dumps(envelope).encode()[1:]
 
 @app.route("/files/write", methods=["POST"])
 @log_request
@@ -777,16 +1390,22 @@ def write_file():
     if not path:
         return jsonify(api_response(False, error="path required")), 400
     
-    with tempfile.NamedTemporaryFile(delete=False, mode="wb") as tmp:
-        if encoding == "base64":
-            tmp.write(base64.b64decode(content))
-        else:
-            tmp.write(content.encode())
-        tmp_path = tmp.name
+    raw = base64.b64decode(content) if encoding == "base64" else content.encode()
     
-    success, _, err = adb("push", tmp_path, path)
-    size = os.path.getsize(tmp_path)
-    os.unlink(tmp_path)
+    # Pipe the bytes into `cat` on the device (no local temp file)
+    try:
+        proc = subprocess.Popen(
+            ["adb", "-s", ADB_TARGET, "shell", f"cat > {shlex.quote(path)}"],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        out, err = proc.communicate(raw, timeout=DEFAULT_TIMEOUT)
+        success = proc.returncode == 0
+        err = (err or out).decode(errors="replace").strip()
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.communicate()
+        success, err = False, "Command timed out"
+    size = len(raw)
     
     return jsonify(api_response(success,
         data={"path": path, "written": success, "size": size},
@@ -818,10 +1437,11 @@ def device_info():
         ("fingerprint", "ro.build.fingerprint")
     ]
     
-    info = {}
-    for name, prop in props:
-        _, value, _ = adb_shell(f"getprop {prop}")
-        info[name] = value
+    # Dump all properties once and look them up locally
+    _, out, _ = adb_shell("getprop")
+    all_props = dict(_RE_GETPROP.findall(out))
+    
+    info = {name: all_props.get(prop, "") for name, prop in props}
     
     # Add screen info
     screen = get_screen_info()
@@ -840,26 +1460,30 @@ def device_status():
     """
     Get device status (battery, network, etc).
     """
-    ensure_connected()
-    
     status = {}
     
+    # Connection check, battery and network queries are independent;
+    # run them concurrently so the endpoint costs one round-trip
+    connected = _POOL.submit(ensure_connected)
+    battery = _POOL.submit(adb_shell, "dumpsys battery")
+    network = _POOL.submit(adb_shell, "dumpsys connectivity | grep 'NetworkAgentInfo'")
+    
     # Battery
-    _, out, _ = adb_shell("dumpsys battery")
+    _, out, _ = battery.result()
     if out:
-        level_match = re.search(r'level: (\d+)', out)
-        status_match = re.search(r'status: (\d+)', out)
+        level_match = _RE_BATT_LEVEL.search(out)
+        status_match = _RE_BATT_STAT.search(out)
         status["battery"] = {
             "level": int(level_match.group(1)) if level_match else None,
             "status": int(status_match.group(1)) if status_match else None
         }
     
     # Network
-    _, out, _ = adb_shell("dumpsys connectivity | grep 'NetworkAgentInfo'")
+    _, out, _ = network.result()
     status["network_connected"] = "CONNECTED" in out if out else False
     
     # ADB connected
-    status["adb_connected"] = ensure_connected()
+    status["adb_connected"] = connected.result()
     
     return jsonify(api_response(True, data=status))
 
@@ -894,7 +1518,15 @@ def shell_command():
     
     success, stdout, stderr = adb_shell(command, timeout=timeout)
     
-    logger.info(f"Shell: {command[:50]}... - success={success}")
+    # Package set may have changed (pm install/uninstall etc.)
+    if "install" in command:
+        _apps_cache.update(user=(0.0, None), all=(0.0, None))
+    # Screen size/density/rotation may have changed
+    if any(s in command for s in _SCREEN_COMMANDS):
+        # -inf: monotonic() counts from boot, so 0.0 can still look fresh
+        _screen_cache["updated_at"] = float("-inf")
+    
+    logger.info("Shell: %.50s... - success=%s", command, success)
     
     return jsonify(api_response(success, data={
         "command": command,
@@ -907,6 +1539,73 @@ def shell_command():
 # API Endpoints: Wait/Sync
 # =============================================================================
 
+# Exits 0 once `dumpsys window` shows no pending animation/app transition
+# Exits 0 once no animation or app transition is pending, 1 at the deadline.
+# grep -q stops reading dumpsys at the first match; polls back off 0.1s -> 0.8s
+_WAIT_IDLE_SCRIPT = (
+    "end=$(($(date +%s) + {timeout})); d=0.1; "
+    "while dumpsys window | grep -qE 'mAnimationPending=true|APP_STATE_READY|APP_STATE_RUNNING'; do "
+    "[ $(date +%s) -lt $end ] || exit 1; sleep $d; "
+    "case $d in 0.1) d=0.2;; 0.2) d=0.4;; *) d=0.8;; esac; done"
+)
+
+def _is_resumed(package: str, activity: str) -> bool:
+    _, out, _ = adb_shell("dumpsys activity activities")
+    resumed = " ".join(_RE_RESUMED.findall(out))
+    return package in resumed and (not activity or activity in resumed)
+
+def wait_for_resume(package: str, activity: str, timeout: float) -> bool:
+    """
+    Block until package (and activity, if given) is the resumed activity.
+    
+    Follows activity start/resume lines from logcat instead of polling
+    dumpsys; any candidate line is confirmed with dumpsys since `-T 1`
+    replays the last (possibly stale) entry. Falls back to polling every
+    500ms if logcat can't be streamed.
+    """
+    deadline = time.monotonic() + timeout
+    try:
+        proc = subprocess.Popen(
+            ["adb", "-s", ADB_TARGET, "shell", "logcat", "-b", "main,events", "-T", "1",
+             "ActivityTaskManager:I", "wm_on_resume_called:I", "am_on_resume_called:I", "*:S"],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+        )
+    except OSError:
+        proc = None
+    
+    try:
+        # Started before the first check so no transition falls in between
+        if _is_resumed(package, activity):
+            return True
+        
+        if proc is not None:
+            pending = b""
+            with selectors.DefaultSelector() as sel:
+                sel.register(proc.stdout, selectors.EVENT_READ)
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    if not sel.select(remaining):
+                        continue
+                    chunk = os.read(proc.stdout.fileno(), 65536)
+                    if not chunk:
+                        break  # logcat went away; poll instead
+                    *lines, pending = (pending + chunk).split(b"\n")
+                    if any(package.encode() in ln and activity.encode() in ln for ln in lines):
+                        if _is_resumed(package, activity):
+                            return True
+        
+        while time.monotonic() < deadline:
+            if _is_resumed(package, activity):
+                return True
+            time.sleep(0.5)
+        return False
+    finally:
+        if proc is not None:
+            proc.kill()
+            proc.wait()
+
 @app.route("/wait/idle", methods=["POST"])
 @log_request
 @require_auth
@@ -916,23 +1615,29 @@ def wait_idle():
     
     Body:
         {
-            "timeout": 10  // Max wait time in seconds
+            "timeout": 10  // Max wait time in seconds (capped at DEFAULT_TIMEOUT)
         }
     
     Returns:
         {"idle": true, "waited_ms": 500}
     """
     data = request.get_json() or {}
-    timeout = data.get("timeout", 10)
+    try:
+        # Capped: a long wait ties up an adb shell on the device
+        timeout = min(max(int(data.get("timeout", 10)), 0), DEFAULT_TIMEOUT)
+    except (TypeError, ValueError):
+        return jsonify(api_response(False, error="timeout must be a number")), 400
     
     ensure_connected()
     
     start = time.time()
-    # Use dumpsys to check window animation state
-    adb_shell(f"cmd activity idle {timeout * 1000}")
+    # Poll the window manager on-device and return as soon as no animation
+    # or app transition is pending (one round-trip, no fixed wait). Runs in
+    # its own adb shell so the shared session stays free for other requests
+    idle, _, _ = adb("shell", _WAIT_IDLE_SCRIPT.format(timeout=timeout), timeout=timeout + 5)
     waited = int((time.time() - start) * 1000)
     
-    return jsonify(api_response(True, data={"idle": True, "waited_ms": waited}))
+    return jsonify(api_response(True, data={"idle": idle, "waited_ms": waited}))
 
 @app.route("/wait/activity", methods=["POST"])
 @log_request
@@ -959,17 +1664,13 @@ def wait_activity():
     ensure_connected()
     
     start = time.time()
-    while time.time() - start < timeout:
-        _, out, _ = adb_shell("dumpsys activity activities | grep mResumedActivity")
-        if package in out:
-            if not activity or activity in out:
-                waited = int((time.time() - start) * 1000)
-                return jsonify(api_response(True, data={
-                    "found": True,
-                    "package": package,
-                    "waited_ms": waited
-                }))
-        time.sleep(0.5)
+    if wait_for_resume(package, activity, timeout):
+        waited = int((time.time() - start) * 1000)
+        return jsonify(api_response(True, data={
+            "found": True,
+            "package": package,
+            "waited_ms": waited
+        }))
     
     return jsonify(api_response(False, data={
         "found": False,
@@ -995,22 +1696,27 @@ def health():
 @app.route("/", methods=["GET"])
 def index():
     """API documentation."""
+    return Response(_index_json(), mimetype="application/json")
+
+@lru_cache(maxsize=None)
+def _index_json() -> bytes:
+    """Endpoint catalog, built once (routes don't change after startup)."""
     endpoints = []
     for rule in app.url_map.iter_rules():
         if rule.endpoint != 'static':
             doc = app.view_functions[rule.endpoint].__doc__
             endpoints.append({
                 "path": rule.rule,
-                "methods": list(rule.methods - {"OPTIONS", "HEAD"}),
+                "methods": sorted(rule.methods - {"OPTIONS", "HEAD"}),
                 "description": doc.strip().split("\n")[0] if doc else ""
             })
     
-    return jsonify({
+    return app.json.dumps({
         "name": "Cloud Phone Agent API",
         "version": "1.0.0",
         "description": "LLM-agent-friendly Android automation API",
         "endpoints": sorted(endpoints, key=lambda x: x["path"])
-    })
+    }).encode()
 
 # =============================================================================
 # Main
@@ -1025,4 +1731,5 @@ if __name__ == "__main__":
     logger.info(f"ADB target: {ADB_TARGET}")
     logger.info(f"Log directory: {LOG_DIR}")
     
+    # Development server; for production use gunicorn (see gunicorn_conf.py)
     app.run(host=host, port=port, debug=debug, threaded=True)
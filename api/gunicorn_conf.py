@@ -0,0 +1,25 @@
+"""
+Gunicorn configuration for the Cloud Phone APIs.
+
+Usage (from the api/ directory):
+    gunicorn -c gunicorn_conf.py agent_api:app
+    API_WORKER_CLASS=gthread gunicorn -c gunicorn_conf.py server:app
+
+The default gevent worker lets requests blocked on ADB subprocesses overlap
+(gthread runs API_WORKER_THREADS threads per worker instead).
+Keep a single worker: the ADB shell session and caches are per-process.
+"""
+
+import os
+
+bind = [f"{os.environ.get('API_HOST', '0.0.0.0')}:{os.environ.get('API_PORT', '8080')}"]
+# Extra Unix socket for co-located clients (no TCP/loopback overhead)
+if os.environ.get("API_UDS"):
+    bind.append(f"unix:{os.environ['API_UDS']}")
+worker_class = os.environ.get("API_WORKER_CLASS", "gevent")
+workers = int(os.environ.get("API_WORKERS", "1"))
+worker_connections = int(os.environ.get("API_WORKER_CONNECTIONS", "1000"))
+timeout = int(os.environ.get("API_WORKER_TIMEOUT", "120"))
+threads = int(os.environ.get("API_WORKER_THREADS", "8"))
+# Hold idle client connections open so polling clients skip the TCP handshake
+keepalive = int(os.environ.get("API_KEEPALIVE", "30"))
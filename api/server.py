@@ -12,20 +12,74 @@ Enhanced API server for Redroid cloud phone control including:
 """
 
 import os
+
+# Cooperative I/O for direct runs (gunicorn's gevent worker patches on its own)
+if os.environ.get("USE_GEVENT"):
+    from gevent import monkey
+    monkey.patch_all()
+
 import json
+import selectors
 import subprocess
 import shlex
+import shutil
+import socket
 import time
 import base64
-import tempfile
+import ipaddress
 import logging
+import queue
+import random
+import re
+import secrets
+import select
+import string
+import struct
 import threading
 import uuid
-from functools import wraps
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, wraps
 from flask import Flask, request, jsonify, Response
 
+# Fast JSON encoding for large (base64) payloads; stdlib json otherwise
+try:
+    import orjson
+    from flask.json.provider import DefaultJSONProvider
+except ImportError:
+    orjson = None
+
+# Response compression (gzip/brotli) for large JSON bodies
+try:
+    from flask_compress import Compress
+except ImportError:
+    Compress = None
+
 app = Flask(__name__)
 
+if orjson is not None:
+    _ORJSON_OPTS = orjson.OPT_NON_STR_KEYS | orjson.OPT_NAIVE_UTC
+
+    class OrjsonProvider(DefaultJSONProvider):
+        """Flask JSON provider backed by orjson (also parses request bodies)"""
+
+        def dumps(self, obj, **kwargs):
+            return orjson.dumps(obj, option=_ORJSON_OPTS, default=self.default).decode()
+
+        def loads(self, s, **kwargs):
+            return orjson.loads(s)
+
+    app.json = OrjsonProvider(app)
+
+if Compress is not None:
+    # JSON only (images are already compressed); streamed responses
+    # (screenshots, pulls, file reads) are left as-is
+    app.config.update(
+        COMPRESS_MIMETYPES=["application/json"],
+        COMPRESS_MIN_SIZE=512,
+        COMPRESS_STREAMS=False,
+    )
+    Compress(app)
+
 # Logging
 LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
 logging.basicConfig(
@@ -41,6 +95,32 @@ CONFIG_FILE = os.environ.get("CONFIG_FILE", "/etc/cloud-phone/config.json")
 PROXY_SCRIPT = "/opt/redroid-scripts/proxy-control.sh"
 JOB_TTL_SECONDS = int(os.environ.get("JOB_TTL_SECONDS", "3600"))
 JOB_MAX = int(os.environ.get("JOB_MAX", "500"))
+CONNECTION_TTL = float(os.environ.get("CONNECTION_TTL", "5"))
+# Persistent adb shells, and one-off shells allowed on top when all are busy
+ADB_SHELL_SESSIONS = int(os.environ.get("ADB_SHELL_SESSIONS", "4"))
+ADB_MAX_ONEOFF = int(os.environ.get("ADB_MAX_ONEOFF", "16"))
+# IME that accepts base64 text broadcasts (ADBKeyboard); `input text` otherwise
+ADB_KEYBOARD_IME = os.environ.get("ADB_KEYBOARD_IME", "com.android.adbkeyboard/.AdbIME")
+# How long a failed connection check is reused before probing again
+CONNECTION_RETRY_TTL = float(os.environ.get("CONNECTION_RETRY_TTL", "1"))
+APPS_CACHE_TTL = float(os.environ.get("APPS_CACHE_TTL", "60"))
+# Local adb server (same variable the adb client reads)
+ADB_SERVER_PORT = int(os.environ.get("ANDROID_ADB_SERVER_PORT", "5037"))
+
+# dumpsys output parsing
+_LEVEL_RE = re.compile(r"^\s*level:\s*(\d+)", re.M)
+_SCREEN_STATE_RE = re.compile(r"mScreenState=(\w+)")
+
+# Request values that end up in shell commands
+_KEYCODE_RE = re.compile(r"^KEYCODE_[A-Z0-9_]+$")
+_HOSTNAME_RE = re.compile(r"^(?!-)[A-Za-z0-9-]{1,63}(?<!-)(\.(?!-)[A-Za-z0-9-]{1,63}(?<!-))*$")
+_NUMBER_LIMIT = 1e6
+
+# `input text` takes %s for spaces; shell quoting is left to shlex.quote
+_INPUT_TRANS = str.maketrans({" ": "%s"})
+
+# ADB errors that mean the device link is gone (forces a re-probe)
+_DISCONNECT_ERRORS = ("device offline", f"'{ADB_CONNECT}' not found", "no device", "broken pipe")
 
 # In-memory state
 _state = {
@@ -50,6 +130,29 @@ _state = {
     "last_adb_error": ""
 }
 
+# Transport id of ADB_CONNECT (adb -t skips the per-call serial lookup); None until probed
+_transport_id = None
+
+# time.monotonic() of the last successful / failed connection check
+_conn_checked_at = 0.0
+_conn_failed_at = 0.0
+_conn_lock = threading.Lock()
+
+# Mock location mechanism ("emu" on emulators, else "broadcast"); None until probed
+_LOCATION_METHOD = None
+
+# Worker pool for independent ADB calls within one request
+_exec = ThreadPoolExecutor(max_workers=8)
+
+# Cached shell output: command -> (stdout, time.monotonic() of read)
+_shell_cache = {}
+
+# Third-party package list; gen bumps on install/uninstall so in-flight refreshes are dropped
+_apps_cache = {"ts": 0.0, "val": None, "gen": 0}
+_apps_refreshing = threading.Lock()
+_launcher_cache = {}  # package -> resolved launcher activity
+STATUS_CACHE_TTL = float(os.environ.get("STATUS_CACHE_TTL", "2"))
+
 # In-memory job queue
 _jobs = {}
 _jobs_lock = threading.Lock()
@@ -58,16 +161,23 @@ _jobs_lock = threading.Lock()
 # Helpers
 # =============================================================================
 
+def _adb_target():
+    """adb client args selecting the device: -t <transport id> once known, else -s"""
+    tid = _transport_id
+    return ["-t", tid] if tid else ["-s", ADB_CONNECT]
+
 def run_adb(*args, timeout=30):
     """Run ADB command and return (success, stdout, stderr)"""
-    cmd = ["adb", "-s", ADB_CONNECT] + list(args)
+    cmd = ["adb"] + _adb_target() + list(args)
     try:
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+        result = subprocess.run(cmd, capture_output=True, text=True,
+                                encoding="utf-8", errors="replace", timeout=timeout)
         success = result.returncode == 0
         stdout = result.stdout.strip()
         stderr = result.stderr.strip()
         if not success:
             _state["last_adb_error"] = stderr or stdout or "adb command failed"
+            _check_disconnect(_state["last_adb_error"])
             logger.warning("ADB command failed: %s | stderr=%s", " ".join(cmd), _state["last_adb_error"])
         return success, stdout, stderr
     except subprocess.TimeoutExpired:
@@ -79,24 +189,365 @@ def run_adb(*args, timeout=30):
         logger.exception("ADB command exception: %s", " ".join(cmd))
         return False, "", str(e)
 
+class _AdbShellSession:
+    """
+    Long-lived `adb shell` that commands are multiplexed over.
+
+    Each command is followed by a unique marker echoed to stdout (with the
+    exit code) and to stderr, which frames its output on the shared pipes.
+    The shell is respawned after EOF, a broken pipe or a timeout. Not
+    thread-safe: run_adb_shell hands each session to one caller at a time.
+    """
+
+    def __init__(self, target):
+        self.target = target
+        self.proc = None
+
+    def alive(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def close(self):
+        if self.proc:
+            try:
+                self.proc.kill()
+                self.proc.wait(timeout=5)
+            except Exception:
+                pass
+        self.proc = None
+
+    def _spawn(self):
+        self.close()
+        self.proc = subprocess.Popen(
+            ["adb", "-s", self.target, "shell"],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            bufsize=0
+        )
+        logger.info("ADB shell session started (pid=%s)", self.proc.pid)
+
+    def _read_until(self, marker, timeout):
+        """Read stdout/stderr until both carry the marker. Returns (stdout, stderr, rc)."""
+        deadline = time.monotonic() + timeout
+        out_fd, err_fd = self.proc.stdout.fileno(), self.proc.stderr.fileno()
+        bufs = {out_fd: bytearray(), err_fd: bytearray()}
+        pending = set(bufs)
+
+        with selectors.DefaultSelector() as sel:
+            for fd in bufs:
+                sel.register(fd, selectors.EVENT_READ)
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError
+                for key, _ in sel.select(remaining):
+                    chunk = os.read(key.fd, 65536)
+                    if not chunk:
+                        raise EOFError
+                    buf = bufs[key.fd]
+                    buf += chunk
+                    idx = buf.find(marker)
+                    if idx != -1 and buf.find(b"\n", idx) != -1:
+                        pending.discard(key.fd)
+                        sel.unregister(key.fd)
+
+        out, err = bufs[out_fd], bufs[err_fd]
+        idx = out.find(marker)
+        rc = int(out[idx + len(marker):out.find(b"\n", idx)] or b"1")
+        return bytes(out[:idx]), bytes(err[:err.find(marker)]), rc
+
+    def run(self, command, timeout=30):
+        """Run a shell command. Returns (success, stdout, stderr)."""
+        try:
+            if not self.alive():
+                self._spawn()
+            marker = f"__END_{uuid.uuid4().hex}__"
+            # Subshell: `exit`, `cd` or exported vars don't leak into later commands
+            script = f"( {command}\n) </dev/null; echo {marker}$?; echo {marker} >&2\n"
+            self.proc.stdin.write(script.encode())
+            out, err, rc = self._read_until(marker.encode(), timeout)
+            stdout = out.decode("utf-8", errors="replace").strip()
+            stderr = err.decode("utf-8", errors="replace").strip()
+            if rc != 0:
+                _state["last_adb_error"] = stderr or stdout or "adb command failed"
+                _check_disconnect(_state["last_adb_error"])
+                logger.warning("ADB shell command failed: %s | stderr=%s", command, _state["last_adb_error"])
+            return rc == 0, stdout, stderr
+        except TimeoutError:
+            _state["last_adb_error"] = "adb command timed out"
+            logger.warning("ADB shell command timed out: %s", command)
+            self.close()
+            return False, "", "Command timed out"
+        except (EOFError, OSError) as e:
+            _state["last_adb_error"] = "adb shell session closed"
+            _state["connected"] = False
+            logger.warning("ADB shell session lost (%s); respawning on next call", type(e).__name__)
+            self.close()
+            return False, "", "ADB shell session closed"
+        except Exception as e:
+            _state["last_adb_error"] = str(e)
+            logger.exception("ADB shell exception: %s", command)
+            self.close()
+            return False, "", str(e)
+
+# Idle shell sessions (each spawns its adb shell on first use)
+_shell_sessions = queue.Queue()
+for _ in range(ADB_SHELL_SESSIONS):
+    _shell_sessions.put(_AdbShellSession(ADB_CONNECT))
+
+# Caps one-off `adb shell` processes started while every session is busy
+_oneoff_slots = threading.BoundedSemaphore(ADB_MAX_ONEOFF)
+
+def _check_disconnect(error):
+    """Drop the cached connection state if an ADB error reports a lost device"""
+    global _transport_id
+    error = error.lower()
+    if any(e in error for e in _DISCONNECT_ERRORS):
+        _state["connected"] = False
+        _transport_id = None
+
 def run_adb_shell(command, timeout=30):
-    """Run ADB shell command"""
-    return run_adb("shell", command, timeout=timeout)
+    """Run ADB shell command over an idle persistent session (one-off `adb shell` if all are busy)"""
+    try:
+        session = _shell_sessions.get_nowait()
+    except queue.Empty:
+        # Back-pressure: wait for a one-off slot rather than piling up adb processes
+        if not _oneoff_slots.acquire(timeout=timeout):
+            _state["last_adb_error"] = "too many concurrent adb commands"
+            logger.warning("ADB busy, dropped shell command: %s", command)
+            return False, "", "ADB busy"
+        try:
+            return run_adb("shell", command, timeout=timeout)
+        finally:
+            _oneoff_slots.release()
+    try:
+        return session.run(command, timeout=timeout)
+    finally:
+        _shell_sessions.put(session)
+
+# Upload copy size (uploads that don't fit os.sendfile)
+_COPY_CHUNK = 4 << 20
+# Smallest upload worth sendfile. Werkzeug spools uploads over 500 KB to disk,
+# so fileno() never forces a smaller, still in-memory one out to a file
+_SENDFILE_MIN = 1 << 20
+
+def _copy_to_pipe(src, pipe):
+    """Copy file object src into pipe, in-kernel via sendfile when src is a large real file"""
+    try:
+        offset = src.tell()
+        remaining = src.seek(0, os.SEEK_END) - offset
+        src.seek(offset)
+        fd = src.fileno() if remaining >= _SENDFILE_MIN else None
+    except (AttributeError, OSError):
+        # Unseekable, or in memory (BytesIO raises io.UnsupportedOperation)
+        fd = None
+    if fd is None:
+        shutil.copyfileobj(src, pipe, _COPY_CHUNK)
+        return
+    pipe.flush()
+    out_fd = pipe.fileno()
+    start = offset
+    try:
+        while remaining > 0:
+            try:
+                sent = os.sendfile(out_fd, fd, offset, min(remaining, _COPY_CHUNK))
+            except BlockingIOError:
+                # Non-blocking pipe (gevent): wait until adb drains it
+                select.select([], [out_fd], [])
+                continue
+            if not sent:
+                break
+            offset += sent
+            remaining -= sent
+    except BrokenPipeError:
+        raise
+    except (AttributeError, OSError):
+        # No sendfile to pipes on this platform
+        if offset != start:
+            raise
+        shutil.copyfileobj(src, pipe, _COPY_CHUNK)
+
+def run_adb_stdin(src, *args, timeout=30):
+    """Run ADB command with src (file object) streamed to its stdin. Returns (success, stdout, stderr)"""
+    cmd = ["adb"] + _adb_target() + list(args)
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    # The deadline covers the upload too: killing adb breaks a copy stuck on a full pipe
+    expired = threading.Event()
+
+    def expire():
+        expired.set()
+        proc.kill()
+    timer = threading.Timer(timeout, expire)
+    timer.start()
+    try:
+        try:
+            _copy_to_pipe(src, proc.stdin)
+        except BrokenPipeError:
+            pass  # adb exited early (or was killed); its stderr says why
+        # communicate() closes stdin (EOF) and collects the output
+        out, err = proc.communicate()
+    finally:
+        timer.cancel()
+    if expired.is_set():
+        _state["last_adb_error"] = "adb command timed out"
+        logger.warning("ADB command timed out: %s", " ".join(cmd))
+        return False, "", "Command timed out"
+    stdout = out.decode("utf-8", errors="replace").strip()
+    stderr = err.decode("utf-8", errors="replace").strip()
+    success = proc.returncode == 0
+    if not success:
+        _state["last_adb_error"] = stderr or stdout or "adb command failed"
+        _check_disconnect(_state["last_adb_error"])
+        logger.warning("ADB command failed: %s | stderr=%s", " ".join(cmd), _state["last_adb_error"])
+    return success, stdout, stderr
+
+def run_adb_shell_batch(commands, timeout=30, stop_on_error=False):
+    """
+    Run several shell commands in one round-trip.
+
+    Returns a (success, stdout, stderr) tuple per command, in order. With
+    stop_on_error, commands after the first failure are skipped.
+    """
+    sep = f"__SEP_{uuid.uuid4().hex}__"
+    stop = "; [ $rc -eq 0 ] || exit 0" if stop_on_error else ""
+    script = "\n".join(f"( {cmd}\n); rc=$?; echo {sep}$rc; echo {sep} >&2{stop}" for cmd in commands)
+    _, out, err = run_adb_shell(script, timeout=timeout)
+
+    # [out1, "rc1\nout2", "rc2\nout3", ..., "rcN"] (plain split; sep is unique per call,
+    # so a regex would be recompiled every time)
+    out_parts = out.split(sep)
+    err_parts = err.split(sep)
+    results = []
+    for i in range(len(commands)):
+        if i + 1 < len(out_parts):
+            stdout = out_parts[i] if i == 0 else out_parts[i].partition("\n")[2]
+            rc = out_parts[i + 1].partition("\n")[0].strip()
+            stderr = err_parts[i].strip() if i < len(err_parts) else ""
+            results.append((rc == "0", stdout.strip(), stderr))
+        elif stop_on_error and results and not results[-1][0]:
+            results.append((False, "", "skipped"))
+        else:
+            # Batch aborted (timeout / lost session) before this command finished
+            results.append((False, "", err or "batch aborted"))
+    return results
+
+def multi_getprop(keys, timeout=30):
+    """Read several system properties in one round-trip. Returns {key: value}"""
+    results = run_adb_shell_batch([f"getprop {k}" for k in keys], timeout=timeout)
+    return {k: out for k, (_, out, _) in zip(keys, results)}
+
+def cached_shell_outputs(commands):
+    """
+    Outputs for [(command, ttl), ...], re-running only stale entries (in one batch).
+
+    ttl=None caches until invalidate_shell_cache(); failed commands aren't cached.
+    """
+    now = time.monotonic()
+    stale = [cmd for cmd, ttl in commands
+             if cmd not in _shell_cache or (ttl is not None and now - _shell_cache[cmd][1] >= ttl)]
+    fresh = {}
+    if stale:
+        for cmd, (ok, out, _) in zip(stale, run_adb_shell_batch(stale)):
+            fresh[cmd] = out
+            if ok:
+                _shell_cache[cmd] = (out, now)
+            else:
+                _shell_cache.pop(cmd, None)
+    return [fresh[cmd] if cmd in fresh else _shell_cache[cmd][0] for cmd, _ in commands]
+
+def invalidate_shell_cache():
+    """Drop cached device properties (after setprop or a reconnect)"""
+    _shell_cache.clear()
+
+def _refresh_apps():
+    """Re-read the third-party package list into _apps_cache"""
+    gen = _apps_cache["gen"]
+    success, out, _ = run_adb_shell("pm list packages -3")  # -3 for third-party only
+    packages = [line.removeprefix("package:") for line in out.splitlines() if line.startswith("package:")]
+    if success and gen == _apps_cache["gen"]:
+        _apps_cache.update(ts=time.monotonic(), val=packages)
+    return success, packages
+
+def _refresh_apps_background():
+    # One refresh at a time; callers keep getting the cached list meanwhile
+    if not _apps_refreshing.acquire(blocking=False):
+        return
+
+    def run():
+        try:
+            _refresh_apps()
+        finally:
+            _apps_refreshing.release()
+    _exec.submit(run)
+
+def invalidate_apps_cache():
+    """Forget the package list (after an install/uninstall)"""
+    _apps_cache.update(ts=0.0, val=None, gen=_apps_cache["gen"] + 1)
+    _launcher_cache.clear()
+
+def _mark_connected():
+    global _conn_checked_at
+    # A (re)connect may be a different device
+    if not _state["connected"]:
+        invalidate_shell_cache()
+        invalidate_apps_cache()
+    _state["connected"] = True
+    _conn_checked_at = time.monotonic()
+
+def _device_listed(devices_out):
+    """
+    Find ADB_CONNECT in `adb devices -l` output
+    
+    Returns (online, transport_id); transport_id is None if not reported.
+    """
+    for line in devices_out.splitlines():
+        fields = line.split()
+        if len(fields) >= 2 and fields[0] == ADB_CONNECT:
+            tid = next((f[13:] for f in fields[2:] if f.startswith("transport_id:")), None)
+            return fields[1] == "device", tid
+    return False, None
 
 def ensure_adb_connected():
-    """Ensure ADB is connected to device"""
-    success, out, _ = run_adb("devices")
-    if ADB_CONNECT in out and "device" in out:
-        _state["connected"] = True
+    """
+    Ensure ADB is connected to device
+    
+    A successful check is trusted for CONNECTION_TTL seconds, a failed one
+    for CONNECTION_RETRY_TTL seconds, so most requests skip the probe.
+    """
+    cached = _cached_connection()
+    if cached is not None:
+        return cached
+    # One probe at a time; requests that queued behind it reuse its result
+    with _conn_lock:
+        cached = _cached_connection()
+        if cached is not None:
+            return cached
+        return _probe_connection()
+
+def _cached_connection():
+    """Connection state if the last check is still trusted, else None"""
+    now = time.monotonic()
+    if _state["connected"]:
+        if now - _conn_checked_at < CONNECTION_TTL:
+            return True
+    elif now - _conn_failed_at < CONNECTION_RETRY_TTL:
+        return False
+    return None
+
+def _probe_connection():
+    global _conn_failed_at, _transport_id
+    success, out, _ = run_adb("devices", "-l")
+    online, _transport_id = _device_listed(out)
+    if online:
+        _mark_connected()
         return True
     
     # Try to connect
     success, out, err = run_adb("connect", ADB_CONNECT)
     if success and "connected" in out.lower():
-        _state["connected"] = True
+        _mark_connected()
         return True
     
     _state["connected"] = False
+    _conn_failed_at = time.monotonic()
     if err or out:
         _state["last_adb_error"] = err or out
         logger.warning("ADB connect failed: %s", _state["last_adb_error"])
@@ -163,8 +614,39 @@ def _do_screen_action(action):
     return {"success": True, "action": action}
 
 
+def _bad_numbers(data, fields):
+    """Fields present in data that aren't finite numbers within ±_NUMBER_LIMIT (they end up in shell commands)"""
+    return [f for f in fields
+            if f in data and (isinstance(data[f], bool) or not isinstance(data[f], (int, float))
+                              or not abs(data[f]) <= _NUMBER_LIMIT)]
+
+def _valid_host(host):
+    """Hostname, IPv4 or IPv6 address"""
+    if not isinstance(host, str) or len(host) > 253:
+        return False
+    try:
+        ipaddress.ip_address(host)
+        return True
+    except ValueError:
+        return bool(_HOSTNAME_RE.match(host))
+
+# Numeric fields per /device/input type
+_INPUT_NUMBERS = {"tap": ("x", "y"), "swipe": ("x1", "y1", "x2", "y2", "duration")}
+
 def _do_device_input(data):
     input_type = data.get("type", "tap")
+    if input_type not in ("tap", "swipe", "text", "key"):
+        return {"success": False, "error": f"unsupported input type: {input_type}"}
+    bad = _bad_numbers(data, _INPUT_NUMBERS.get(input_type, ()))
+    if bad:
+        return {"success": False, "error": f"{', '.join(bad)} must be numeric"}
+    if input_type == "text" and not isinstance(data.get("text", ""), str):
+        return {"success": False, "error": "text must be a string"}
+    if input_type == "key":
+        keycode = data.get("keycode", 4)
+        if isinstance(keycode, bool) or not (
+                isinstance(keycode, int) or (isinstance(keycode, str) and _KEYCODE_RE.match(keycode))):
+            return {"success": False, "error": "keycode must be an integer or KEYCODE_* name"}
     if input_type == "tap":
         x, y = data.get("x", 500), data.get("y", 500)
         run_adb_shell(f"input tap {x} {y}")
@@ -174,23 +656,189 @@ def _do_device_input(data):
         duration = data.get("duration", 300)
         run_adb_shell(f"input swipe {x1} {y1} {x2} {y2} {duration}")
     elif input_type == "text":
+        # One base64 broadcast when ADBKeyboard is active (unicode, no
+        # escaping); plain `input text` only types basic Latin
         text = data.get("text", "")
-        text = text.replace(" ", "%s").replace("'", "\\'")
-        run_adb_shell(f"input text '{text}'")
+        b64 = base64.b64encode(text.encode()).decode()
+        run_adb_shell(
+            f"if [ \"$(settings get secure default_input_method)\" = {shlex.quote(ADB_KEYBOARD_IME)} ]; "
+            f"then am broadcast -a ADB_INPUT_B64 --es msg {b64} >/dev/null; "
+            f"else input text {shlex.quote(text.translate(_INPUT_TRANS))}; fi"
+        )
     elif input_type == "key":
-        keycode = data.get("keycode", 4)
         run_adb_shell(f"input keyevent {keycode}")
     return {"success": True, "type": input_type}
 
 
 def _do_screenshot_base64():
-    result = subprocess.run(
-        ["adb", "-s", ADB_CONNECT, "exec-out", "screencap", "-p"],
-        capture_output=True, timeout=30
+    stream, close, first = _open_screencap()
+    if not stream:
+        return {"success": False, "error": "Command timed out" if first is None else "Failed to capture screenshot"}
+    try:
+        image = first + stream.read()
+    finally:
+        close()
+    return {"success": True, "image_base64": base64.b64encode(image).decode()}
+
+
+# Multiple of 3 so each chunk base64-encodes without padding
+_STREAM_CHUNK = 57 * 1024
+
+
+def _recv_exact(sock, size):
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def _adb_server_request(sock, service):
+    """Send one adb server (smart socket) request; raises ConnectionError unless OKAY."""
+    sock.sendall(b"%04x%s" % (len(service), service.encode()))
+    status = _recv_exact(sock, 4)
+    if status != b"OKAY":
+        size = _recv_exact(sock, 4)
+        message = _recv_exact(sock, int(size, 16)) if size else b""
+        raise ConnectionError(message.decode(errors="replace") or f"adb server replied {status!r}")
+
+
+def _exec_out(command, timeout=30):
+    """
+    Run `adb exec-out command`; returns (binary stream, close callable).
+
+    Talks to the adb server socket directly so no adb client process is
+    spawned; falls back to the adb binary if the server can't be reached.
+    """
+    try:
+        sock = socket.create_connection(("127.0.0.1", ADB_SERVER_PORT), timeout=timeout)
+    except OSError:
+        sock = None
+    if sock is not None:
+        try:
+            tid = _transport_id
+            _adb_server_request(sock, f"host:transport-id:{tid}" if tid else f"host:transport:{ADB_CONNECT}")
+            _adb_server_request(sock, f"exec:{command}")
+            stream = sock.makefile("rb")
+
+            def close():
+                stream.close()
+                sock.close()
+            return stream, close
+        except (OSError, ValueError) as e:
+            sock.close()
+            _state["last_adb_error"] = str(e)
+            _check_disconnect(str(e))
+            logger.warning("adb server exec failed (%s); falling back to adb binary", e)
+
+    proc = subprocess.Popen(
+        ["adb"] + _adb_target() + ["exec-out", command],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
     )
-    if result.returncode == 0 and result.stdout:
-        return {"success": True, "image_base64": base64.b64encode(result.stdout).decode()}
-    return {"success": False, "error": "Failed to capture screenshot"}
+
+    def close():
+        proc.kill()
+        proc.wait()
+    return proc.stdout, close
+
+
+def _read_first(stream, close, size=_STREAM_CHUNK):
+    """First chunk of an _exec_out stream; None (stream closed) if the adb server socket timed out"""
+    try:
+        return stream.read(size)
+    except socket.timeout:
+        close()
+        _state["last_adb_error"] = "adb command timed out"
+        logger.warning("adb exec-out timed out waiting for the device")
+        return None
+
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+def _open_screencap():
+    """
+    Start `screencap -p`; returns (stream, close, first_chunk), or
+    (None, None, b"") on failure and (None, None, None) on timeout.
+    """
+    stream, close = _exec_out("screencap -p")
+    # Wait for data before committing to a 200 response
+    first = _read_first(stream, close)
+    if first is None:
+        return None, None, None
+    if not first.startswith(_PNG_SIGNATURE):
+        close()
+        if first:
+            # screencap printed an error instead of an image
+            _state["last_adb_error"] = first[:200].decode("utf-8", errors="replace").strip()
+            logger.warning("screencap returned no PNG: %s", _state["last_adb_error"])
+        return None, None, b""
+    return stream, close, first
+
+
+def _open_screencap_raw():
+    """
+    Start raw `screencap`; returns (stream, close, first_pixels, width, height, pixel_format).
+    The stream carries the RGBA pixels after the header. stream is None on
+    failure, and first_pixels is None too on timeout.
+    """
+    stream, close = _exec_out("screencap")
+    header = _read_first(stream, close, 16)
+    if header is None:
+        return None, None, None, 0, 0, 0
+    if len(header) < 16:
+        close()
+        return None, None, b"", 0, 0, 0
+    width, height, pixel_format, word = struct.unpack("<IIII", header)
+    # Android 8+ appends a small colorspace word; older versions go straight to
+    # pixels, whose first word has the (opaque) alpha byte in its top bits
+    first = b"" if word < 0x100 else header[12:]
+    return stream, close, first, width, height, pixel_format
+
+def _stream_output(stream, close, first):
+    """Yield a command's output in chunks, then close it."""
+    try:
+        chunk = first
+        while chunk:
+            yield chunk
+            chunk = stream.read(_STREAM_CHUNK)
+    finally:
+        close()
+
+
+def _stream_base64_json(stream, close, first, field, fields=None, expected_size=None):
+    """
+    Yield a JSON object whose `field` is a command's output, base64-encoded
+    chunk by chunk. success/error follow the content so they report how the
+    transfer ended: a read error, or fewer than expected_size bytes, is a
+    failure even though the response status is already 200.
+    """
+    size, error, rest = 0, None, b""
+    head = json.dumps(fields)[:-1] + ", " if fields else "{"
+    try:
+        yield f'{head}"{field}": "'.encode()
+        chunk = first
+        while chunk:
+            size += len(chunk)
+            # Encode whole 3-byte groups only: padding mid-string would corrupt it
+            chunk = rest + chunk
+            cut = len(chunk) - len(chunk) % 3
+            rest = chunk[cut:]
+            yield base64.b64encode(chunk[:cut])
+            chunk = stream.read(_STREAM_CHUNK)
+    except OSError as e:
+        error = f"transfer failed: {e}"
+    finally:
+        close()
+    if rest:
+        yield base64.b64encode(rest)
+    if error is None and expected_size is not None and size != expected_size:
+        error = f"short read: {size} of {expected_size} bytes"
+    tail = {"size": size, "success": error is None}
+    if error:
+        tail["error"] = error
+    yield b'", ' + json.dumps(tail)[1:].encode()
 
 
 def _handle_job(job_type, payload):
@@ -231,6 +879,7 @@ def _handle_job(job_type, payload):
         if not package:
             return {"success": False, "error": "package required"}
         success, out, err = run_adb_shell(f"pm uninstall {package}")
+        invalidate_apps_cache()
         return {"success": success, "message": out or err}
     return {"success": False, "error": f"unsupported job type: {job_type}"}
 
@@ -266,12 +915,17 @@ def status():
     """Detailed device status"""
     ensure_adb_connected()
     
-    # Get device properties
-    success, model, _ = run_adb_shell("getprop ro.product.model")
-    success, android_version, _ = run_adb_shell("getprop ro.build.version.release")
-    success, sdk, _ = run_adb_shell("getprop ro.build.version.sdk")
-    success, battery, _ = run_adb_shell("dumpsys battery | grep level")
-    success, screen, _ = run_adb_shell("dumpsys display | grep mScreenState")
+    # Build props are cached until changed; battery/screen for STATUS_CACHE_TTL.
+    # Whatever is stale is read in one round-trip.
+    model, android_version, sdk, battery, screen = cached_shell_outputs([
+        ("getprop ro.product.model", None),
+        ("getprop ro.build.version.release", None),
+        ("getprop ro.build.version.sdk", None),
+        ("dumpsys battery", STATUS_CACHE_TTL),
+        ("dumpsys display", STATUS_CACHE_TTL),
+    ])
+    level = _LEVEL_RE.search(battery)
+    screen_state = _SCREEN_STATE_RE.search(screen)
     
     return jsonify({
         "connected": _state["connected"],
@@ -280,8 +934,8 @@ def status():
             "android_version": android_version or "unknown",
             "sdk_version": sdk or "unknown"
         },
-        "battery": battery.split(":")[-1].strip() if battery else "unknown",
-        "screen_state": "on" if "ON" in screen else "off" if screen else "unknown",
+        "battery": level.group(1) if level else "unknown",
+        "screen_state": ("on" if screen_state.group(1) == "ON" else "off") if screen_state else "unknown",
         "proxy": _state["proxy"],
         "location": _state["location"]
     })
@@ -323,6 +977,12 @@ def set_proxy():
     
     if enabled and (not host or not port):
         return jsonify({"error": "host and port required when enabled"}), 400
+    if enabled and proxy_type not in ("http", "socks5", "transparent"):
+        return jsonify({"error": f"unsupported proxy type: {proxy_type}"}), 400
+    if enabled and not (str(port).isdigit() and 0 < int(port) < 65536):
+        return jsonify({"error": "port must be a number"}), 400
+    if enabled and not _valid_host(host):
+        return jsonify({"error": "host must be a hostname or IP address"}), 400
     
     success = False
     message = ""
@@ -418,6 +1078,7 @@ def set_location():
         "accuracy": 10
     }
     """
+    global _LOCATION_METHOD
     data = request.get_json() or {}
     
     enabled = data.get("enabled", False)
@@ -426,30 +1087,44 @@ def set_location():
     altitude = data.get("altitude", 0)
     accuracy = data.get("accuracy", 10)
     
+    bad = _bad_numbers(data, ("latitude", "longitude", "altitude", "accuracy"))
+    if bad:
+        return jsonify({"error": f"{', '.join(bad)} must be numeric"}), 400
+    
     if enabled:
-        # Enable mock locations in developer settings
-        run_adb_shell("settings put secure mock_location 1")
-        
-        # Method 1: Use geo fix command via adb
         # Format: geo fix <longitude> <latitude> [altitude] [satellites] [velocity]
-        success, out, err = run_adb_shell(
+        geo_fix = f"geo fix {longitude} {latitude} {altitude}"
+        broadcast = (
             f"am broadcast -a android.intent.action.MOCK_LOCATION "
             f"--ef latitude {latitude} --ef longitude {longitude} "
             f"--ef altitude {altitude} --ef accuracy {accuracy}"
         )
         
-        # Method 2: Use appops to allow mock location for shell
-        run_adb_shell("appops set com.android.shell android:mock_location allow")
+        if not _state["location"]["enabled"]:
+            # Turning mock location on: developer setting + appops for the shell
+            run_adb_shell_batch([
+                "settings put secure mock_location 1",
+                "appops set com.android.shell android:mock_location allow",
+            ])
         
-        # Method 3: Direct geo command (telnet-style, may not work on all)
-        geo_cmd = f"geo fix {longitude} {latitude} {altitude}"
-        run_adb("emu", geo_cmd)
+        if _LOCATION_METHOD is None:
+            # `adb emu geo fix` only works on emulators; otherwise broadcast
+            success, _, _ = run_adb("emu", geo_fix)
+            _LOCATION_METHOD = "emu" if success else "broadcast"
+            logger.info("Mock location method: %s", _LOCATION_METHOD)
+            if not success:
+                success, _, _ = run_adb_shell(broadcast)
+        elif _LOCATION_METHOD == "emu":
+            success, _, _ = run_adb("emu", geo_fix)
+        else:
+            success, _, _ = run_adb_shell(broadcast)
         
-        # Alternative: Use location mock app if installed
-        run_adb_shell(
-            f"am start -a android.intent.action.VIEW "
-            f"-d 'geo:{latitude},{longitude}'"
-        )
+        if not success:
+            return jsonify({
+                "success": False,
+                "message": _state["last_adb_error"] or "failed to set location",
+                "location": _state["location"]
+            })
         
         _state["location"] = {
             "enabled": True,
@@ -505,6 +1180,10 @@ def adb_shell():
     
     ensure_adb_connected()
     success, stdout, stderr = run_adb_shell(command, timeout=timeout)
+    if "setprop" in command:
+        invalidate_shell_cache()
+    if "install" in command:
+        invalidate_apps_cache()
     
     return jsonify({
         "success": success,
@@ -512,6 +1191,42 @@ def adb_shell():
         "stderr": stderr
     })
 
+@app.route("/adb/batch", methods=["POST"])
+@require_auth
+def adb_batch():
+    """
+    Execute several ADB shell commands in one round-trip
+    
+    Body:
+    {
+        "commands": ["getprop ro.product.model", "wm size"],
+        "stop_on_error": false,  // skip the rest after a failing command
+        "timeout": 30
+    }
+    """
+    data = request.get_json() or {}
+    commands = data.get("commands", [])
+    timeout = data.get("timeout", 30)
+    stop_on_error = bool(data.get("stop_on_error", False))
+    
+    if not commands or not isinstance(commands, list):
+        return jsonify({"error": "commands list required"}), 400
+    
+    ensure_adb_connected()
+    results = run_adb_shell_batch([str(c) for c in commands], timeout=timeout, stop_on_error=stop_on_error)
+    if any("setprop" in str(c) for c in commands):
+        invalidate_shell_cache()
+    if any("install" in str(c) for c in commands):
+        invalidate_apps_cache()
+    
+    return jsonify({
+        "success": all(ok for ok, _, _ in results),
+        "results": [
+            {"command": cmd, "success": ok, "stdout": out, "stderr": err}
+            for cmd, (ok, out, err) in zip(commands, results)
+        ]
+    })
+
 @app.route("/adb/push", methods=["POST"])
 @require_auth
 def adb_push():
@@ -528,10 +1243,10 @@ def adb_push():
     file = request.files["file"]
     dest_path = request.form.get("path", f"/sdcard/{file.filename}")
     
-    with tempfile.NamedTemporaryFile(delete=False) as tmp:
-        file.save(tmp.name)
-        success, out, err = run_adb("push", tmp.name, dest_path)
-        os.unlink(tmp.name)
+    # Stream the upload straight onto the device (no local temp copy)
+    success, out, err = run_adb_stdin(file.stream, "exec-in", f"cat > {shlex.quote(dest_path)}")
+    if success and not out:
+        out = f"pushed to {dest_path}"
     
     return jsonify({
         "success": success,
@@ -547,31 +1262,41 @@ def adb_pull():
     
     Body:
     {
-        "path": "/sdcard/myfile.txt"
+        "path": "/sdcard/myfile.txt",
+        "format": "base64"  // or "raw" for the bytes as application/octet-stream
     }
     
     Returns: File content as base64
     """
     data = request.get_json() or {}
     path = data.get("path", "")
+    raw = data.get("format", "base64") == "raw"
     
     if not path:
         return jsonify({"error": "path required"}), 400
     
-    with tempfile.NamedTemporaryFile(delete=False) as tmp:
-        success, out, err = run_adb("pull", path, tmp.name)
-        if success and os.path.exists(tmp.name):
-            with open(tmp.name, "rb") as f:
-                content = base64.b64encode(f.read()).decode()
-            os.unlink(tmp.name)
-            return jsonify({
-                "success": True,
-                "path": path,
-                "content_base64": content
-            })
-        os.unlink(tmp.name)
-    
-    return jsonify({"success": False, "error": err}), 404
+    quoted = shlex.quote(path)
+    exists, size, _ = run_adb_shell(f"[ -f {quoted} ] && [ -r {quoted} ] && stat -c %s {quoted}")
+    if not exists:
+        return jsonify({"success": False, "error": f"{path}: file not found or not readable"}), 404
+    
+    # Stream from the device (base64-encoded chunk by chunk unless raw)
+    stream, close = _exec_out(f"cat {quoted}")
+    first = _read_first(stream, close)
+    if first is None:
+        return jsonify({"success": False, "error": "Command timed out"}), 504
+    if raw:
+        filename = os.path.basename(path).replace('"', "")
+        return Response(
+            _stream_output(stream, close, first),
+            mimetype="application/octet-stream",
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+        )
+    return Response(
+        _stream_base64_json(stream, close, first, "content_base64", {"path": path},
+                            expected_size=int(size) if size.isdigit() else None),
+        mimetype="application/json"
+    )
 
 @app.route("/adb/install", methods=["POST"])
 @require_auth
@@ -589,10 +1314,18 @@ def adb_install():
     file = request.files["file"]
     options = request.form.get("options", "-r").split()
     
-    with tempfile.NamedTemporaryFile(suffix=".apk", delete=False) as tmp:
-        file.save(tmp.name)
-        success, out, err = run_adb("install", *options, tmp.name, timeout=120)
-        os.unlink(tmp.name)
+    # Streamed install (what `adb install` does internally): pm reads SIZE bytes from stdin
+    stream = file.stream
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    success, out, err = run_adb_stdin(
+        stream, "exec-in", " ".join(["cmd", "package", "install", "-S", str(size)] + [shlex.quote(o) for o in options]),
+        timeout=120
+    )
+    # pm reports failures on stdout with exit status 0
+    success = success and "Failure" not in out
+    invalidate_apps_cache()
     
     return jsonify({
         "success": success,
@@ -639,28 +1372,55 @@ def device_input():
     }
     """
     data = request.get_json() or {}
-    return jsonify(_do_device_input(data))
+    result = _do_device_input(data)
+    return jsonify(result), 200 if result["success"] else 400
 
 @app.route("/device/screenshot", methods=["GET"])
 @require_auth
 def screenshot():
-    """Take screenshot and return as PNG"""
+    """
+    Take screenshot and return as PNG
+    
+    Query:
+    - format: "png" (default) or "rgba" for the raw pixel buffer with
+      X-Width/X-Height/X-Pixel-Format headers (skips on-device PNG encoding)
+    """
     ensure_adb_connected()
-    result = subprocess.run(
-        ["adb", "-s", ADB_CONNECT, "exec-out", "screencap", "-p"],
-        capture_output=True, timeout=30
-    )
-    if result.returncode == 0 and result.stdout:
-        return Response(result.stdout, mimetype="image/png")
+    if request.args.get("format", "png") == "rgba":
+        stream, close, first, width, height, pixel_format = _open_screencap_raw()
+        if stream and not first:
+            first = _read_first(stream, close)
+        if first is None:
+            return jsonify({"error": "Command timed out"}), 504
+        if not stream:
+            return jsonify({"error": "Failed to capture screenshot"}), 500
+        return Response(
+            _stream_output(stream, close, first),
+            mimetype="application/octet-stream",
+            headers={"X-Width": str(width), "X-Height": str(height), "X-Pixel-Format": str(pixel_format)}
+        )
+    
+    stream, close, first = _open_screencap()
+    if stream:
+        return Response(_stream_output(stream, close, first), mimetype="image/png")
+    if first is None:
+        return jsonify({"error": "Command timed out"}), 504
     return jsonify({"error": "Failed to capture screenshot"}), 500
 
 @app.route("/device/screenshot/base64", methods=["GET"])
 @require_auth
 def screenshot_base64():
     """Take screenshot and return as base64 JSON"""
-    result = _do_screenshot_base64()
-    status = 200 if result.get("success") else 500
-    return jsonify(result), status
+    stream, close, first = _open_screencap()
+    if first is None:
+        return jsonify({"success": False, "error": "Command timed out"}), 504
+    if not stream:
+        return jsonify({"success": False, "error": "Failed to capture screenshot"}), 500
+    # Encode chunk by chunk rather than buffering the whole PNG
+    return Response(
+        _stream_base64_json(stream, close, first, "image_base64"),
+        mimetype="application/json"
+    )
 
 # =============================================================================
 # App Management Endpoints
@@ -669,9 +1429,18 @@ def screenshot_base64():
 @app.route("/apps", methods=["GET"])
 @require_auth
 def list_apps():
-    """List installed apps"""
-    success, out, _ = run_adb_shell("pm list packages -3")  # -3 for third-party only
-    packages = [line.replace("package:", "") for line in out.split("\n") if line]
+    """
+    List installed apps
+    
+    Served from memory; a list older than APPS_CACHE_TTL is returned as-is
+    while a background refresh runs. ?refresh=true re-reads it first.
+    """
+    packages = _apps_cache["val"]
+    success = True
+    if packages is None or request.args.get("refresh", "false").lower() == "true":
+        success, packages = _refresh_apps()
+    elif time.monotonic() - _apps_cache["ts"] >= APPS_CACHE_TTL:
+        _refresh_apps_background()
     
     return jsonify({
         "success": success,
@@ -683,18 +1452,29 @@ def list_apps():
 @require_auth
 def start_app(package):
     """Start an app by package name"""
-    # Get main activity
-    success, out, _ = run_adb_shell(
-        f"cmd package resolve-activity --brief {package} | tail -n 1"
+    activity = _launcher_cache.get(package)
+    if activity:
+        # Known launcher activity: skip resolve-activity. am reports a stale
+        # component (app updated or reinstalled) as "Error: ... does not
+        # exist" on stderr, usually with exit code 0
+        success, out, err = run_adb_shell(f"am start -n {shlex.quote(activity)}")
+        if success and "Error" not in out + err:
+            return jsonify({"success": True, "activity": activity})
+        _launcher_cache.pop(package, None)
+    
+    # Resolve the main activity and start it in one round-trip; echoes the
+    # activity, or nothing if it fell back to monkey
+    pkg = shlex.quote(package)
+    _, out, _ = run_adb_shell(
+        f"a=$(cmd package resolve-activity --brief {pkg} | tail -n 1); "
+        f'case "$a" in */*) am start -n "$a" >/dev/null; echo "$a";; '
+        f"*) monkey -p {pkg} -c android.intent.category.LAUNCHER 1 >/dev/null;; esac"
     )
     
-    if success and out:
-        activity = out.strip()
-        run_adb_shell(f"am start -n {activity}")
+    activity = out.strip()
+    if activity:
+        _launcher_cache[package] = activity
         return jsonify({"success": True, "activity": activity})
-    
-    # Fallback: use monkey
-    run_adb_shell(f"monkey -p {package} -c android.intent.category.LAUNCHER 1")
     return jsonify({"success": True, "package": package})
 
 @app.route("/apps/<package>/stop", methods=["POST"])
@@ -709,6 +1489,7 @@ def stop_app(package):
 def uninstall_app(package):
     """Uninstall an app"""
     success, out, err = run_adb("uninstall", package)
+    invalidate_apps_cache()
     return jsonify({"success": success, "message": out or err})
 
 @app.route("/apps/<package>/clear", methods=["POST"])
@@ -785,51 +1566,113 @@ def update_config():
 PROFILES_DIR = os.environ.get("PROFILES_DIR", "/opt/cloud-phone/config/device-profiles")
 ANTIDETECT_SCRIPT = "/opt/redroid-scripts/anti-detection.sh"
 
-# In-memory device state
+# Fixed steps of POST /device/antidetect
+_HIDE_EMULATOR_CMDS = (
+    "setprop ro.kernel.qemu 0",
+    "setprop ro.hardware.virtual_device 0",
+    "setprop ro.boot.qemu 0",
+    "setprop qemu.hw.mainkeys 0",
+)
+_HIDE_ROOT_CMDS = (
+    "setprop ro.debuggable 0",
+    "setprop ro.secure 1",
+    "setprop ro.boot.verifiedbootstate green",
+    "setprop ro.boot.flash.locked 1",
+)
+_SPOOF_BATTERY_CMDS = (
+    "dumpsys battery set status 3",  # Not charging
+    "dumpsys battery set ac 0",
+    "dumpsys battery set usb 0",
+)
+
+# Profiles accepted by POST /device/identity
+_PROFILE_FILES = {
+    "samsung-galaxy-s21": "samsung-galaxy-s21.prop",
+    "google-pixel-6": "google-pixel-6.prop",
+    "oneplus-9-pro": "oneplus-9-pro.prop"
+}
+_PROFILE_NAMES = tuple(_PROFILE_FILES)
+
+# key=value lines of a .prop file (blank lines and # comments don't match)
+_PROP_RE = re.compile(r'^[ \t]*([^#\s=][^=\n]*?)[ \t]*=[ \t]*(.*?)[ \t\r]*$', re.M)
+
+# Serial number alphabet (no I/O)
+_SERIAL_CHARS = string.digits + string.ascii_uppercase.translate(str.maketrans('', '', 'IO'))
+# Luhn: digit sum of 2*d
+_LUHN_DOUBLE = (0, 2, 4, 6, 8, 1, 3, 5, 7, 9)
+
+# In-memory device state. Writers hold _STATE_LOCK and replace values whole,
+# so readers can go without it.
+_STATE_LOCK = threading.RLock()
 _device_state = {
     "profile": None,
     "hardware_ids": {},
     "antidetect_enabled": False
 }
 
+@lru_cache(maxsize=32)
+def _parse_profile(path, mtime_ns):
+    """(key, value) pairs of a .prop profile; mtime_ns keys the cache to the file version"""
+    with open(path) as f:
+        return tuple(_PROP_RE.findall(f.read()))
+
+@lru_cache(maxsize=4)
+def _profile_names(directory, mtime_ns):
+    """Profile names in directory; mtime_ns keys the cache to the directory version"""
+    return tuple(f[:-5] for f in os.listdir(directory) if f.endswith('.prop'))
+
+def _profile_props(name):
+    """(key, value) pairs of a known profile, () if unknown or missing"""
+    if name not in _PROFILE_FILES:
+        return ()
+    path = os.path.join(PROFILES_DIR, _PROFILE_FILES[name])
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except OSError:
+        return ()
+    return _parse_profile(path, mtime_ns)
+
+def _load_all_profiles():
+    """Parse every profile in PROFILES_DIR up front so requests hit warm caches"""
+    if not os.path.isdir(PROFILES_DIR):
+        return
+    try:
+        names = _profile_names(PROFILES_DIR, os.stat(PROFILES_DIR).st_mtime_ns)
+        for name in names:
+            path = os.path.join(PROFILES_DIR, name + ".prop")
+            _parse_profile(path, os.stat(path).st_mtime_ns)
+    except OSError as e:
+        logger.warning("Could not preload device profiles from %s: %s", PROFILES_DIR, e)
+
+_load_all_profiles()
+
 def generate_imei():
     """Generate valid IMEI with Luhn checksum"""
-    import random
-    tac = f"35{random.randint(1000, 9999)}0"
-    snr = f"{random.randint(0, 999999):06d}"
+    n = int.from_bytes(os.urandom(6), "big")
+    # 8-digit TAC + 6-digit serial + check digit = 15 digits
+    tac = f"35{10000 + n % 90000}0"
+    snr = f"{n // 90000 % 1000000:06d}"
     imei_base = tac + snr
     
-    # Luhn checksum
-    total = 0
-    for i, digit in enumerate(imei_base):
-        d = int(digit)
-        if i % 2 == 1:
-            d *= 2
-            if d > 9:
-                d -= 9
-        total += d
+    # Luhn checksum (odd positions doubled, digits of the product summed)
+    total = sum(map(int, imei_base[::2])) + sum(_LUHN_DOUBLE[int(d)] for d in imei_base[1::2])
     check = (10 - (total % 10)) % 10
     return imei_base + str(check)
 
 def generate_serial():
     """Generate realistic serial number"""
-    import random
-    import string
-    chars = string.digits + string.ascii_uppercase.replace('I', '').replace('O', '')
-    return ''.join(random.choice(chars) for _ in range(11))
+    return ''.join(secrets.choice(_SERIAL_CHARS) for _ in range(11))
 
 def generate_mac():
     """Generate random MAC address"""
-    import random
     vendors = ["00:1A:2B", "00:1E:C9", "00:26:BB", "D8:FC:93", "F4:F5:D8"]
     prefix = random.choice(vendors)
-    suffix = ":".join(f"{random.randint(0, 255):02X}" for _ in range(3))
+    suffix = os.urandom(3).hex(":").upper()
     return f"{prefix}:{suffix}"
 
 def generate_android_id():
     """Generate 16-char hex Android ID"""
-    import random
-    return ''.join(random.choice('0123456789abcdef') for _ in range(16))
+    return os.urandom(8).hex()
 
 @app.route("/device/identity", methods=["GET"])
 @require_auth
@@ -837,14 +1680,17 @@ def get_device_identity():
     """Get current device identity/spoofing status"""
     ensure_adb_connected()
     
-    # Get current values
-    _, model, _ = run_adb_shell("getprop ro.product.model")
-    _, brand, _ = run_adb_shell("getprop ro.product.brand")
-    _, fingerprint, _ = run_adb_shell("getprop ro.build.fingerprint")
-    _, android_id, _ = run_adb_shell("settings get secure android_id")
-    _, serial, _ = run_adb_shell("getprop ro.serialno")
-    _, debuggable, _ = run_adb_shell("getprop ro.debuggable")
-    _, qemu, _ = run_adb_shell("getprop ro.kernel.qemu")
+    # Get current values (one round-trip)
+    results = run_adb_shell_batch([
+        "getprop ro.product.model",
+        "getprop ro.product.brand",
+        "getprop ro.build.fingerprint",
+        "settings get secure android_id",
+        "getprop ro.serialno",
+        "getprop ro.debuggable",
+        "getprop ro.kernel.qemu",
+    ])
+    model, brand, fingerprint, android_id, serial, debuggable, qemu = (out for _, out, _ in results)
     
     return jsonify({
         "current": {
@@ -882,68 +1728,58 @@ def set_device_identity():
     generate_ids = data.get("generate_ids", True)
     custom = data.get("custom", {})
     
-    ensure_adb_connected()
-    
-    # Generate hardware IDs if requested
-    if generate_ids:
-        _device_state["hardware_ids"] = {
-            "imei": generate_imei(),
-            "imei2": generate_imei(),
-            "serial": generate_serial(),
-            "mac_wifi": generate_mac(),
-            "mac_bt": generate_mac(),
-            "android_id": generate_android_id()
-        }
+    if not isinstance(profile, str) or not isinstance(custom, dict):
+        return jsonify({"error": "profile must be a string and custom an object"}), 400
     
-    # Apply custom values if provided
-    if custom:
-        _device_state["hardware_ids"].update(custom)
+    ensure_adb_connected()
     
-    # Load and apply profile
-    profile_file = None
-    profiles = {
-        "samsung-galaxy-s21": "samsung-galaxy-s21.prop",
-        "google-pixel-6": "google-pixel-6.prop",
-        "oneplus-9-pro": "oneplus-9-pro.prop"
-    }
+    # Build the new hardware IDs aside, then swap them in (readers never see a partial dict)
+    with _STATE_LOCK:
+        if generate_ids:
+            ids = {
+                "imei": generate_imei(),
+                "imei2": generate_imei(),
+                "serial": generate_serial(),
+                "mac_wifi": generate_mac(),
+                "mac_bt": generate_mac(),
+                "android_id": generate_android_id()
+            }
+        else:
+            ids = dict(_device_state["hardware_ids"])
+        
+        # Apply custom values if provided
+        if custom:
+            ids.update(custom)
+        _device_state["hardware_ids"] = ids
     
     if profile == "random":
-        import random
-        profile = random.choice(list(profiles.keys()))
+        profile = random.choice(_PROFILE_NAMES)
     
-    if profile in profiles:
-        profile_file = os.path.join(PROFILES_DIR, profiles[profile])
-    
-    # Apply profile properties
+    # Profile properties and hardware IDs go to the device as one script
+    commands = []
     applied_props = []
-    if profile_file and os.path.exists(profile_file):
-        with open(profile_file) as f:
-            for line in f:
-                line = line.strip()
-                if not line or line.startswith('#'):
-                    continue
-                if '=' in line:
-                    key, value = line.split('=', 1)
-                    run_adb_shell(f"setprop {key} '{value}'")
-                    applied_props.append(key)
-    
-    # Apply hardware IDs
-    ids = _device_state["hardware_ids"]
+    for key, value in _profile_props(profile):
+        commands.append(f"setprop {shlex.quote(key)} {shlex.quote(value)}")
+        applied_props.append(key)
+    
     if "android_id" in ids:
-        run_adb_shell(f"settings put secure android_id '{ids['android_id']}'")
+        commands.append(f"settings put secure android_id {shlex.quote(str(ids['android_id']))}")
     if "serial" in ids:
-        run_adb_shell(f"setprop ro.serialno '{ids['serial']}'")
-        run_adb_shell(f"setprop ro.boot.serialno '{ids['serial']}'")
+        commands.append(f"setprop ro.serialno {shlex.quote(str(ids['serial']))}")
+        commands.append(f"setprop ro.boot.serialno {shlex.quote(str(ids['serial']))}")
     if "imei" in ids:
-        run_adb_shell(f"setprop gsm.sim.imei '{ids['imei']}'")
+        commands.append(f"setprop gsm.sim.imei {shlex.quote(str(ids['imei']))}")
+    if commands:
+        run_adb_shell("\n".join(commands), timeout=60)
     
-    _device_state["profile"] = profile
-    _device_state["antidetect_enabled"] = True
+    invalidate_shell_cache()
+    with _STATE_LOCK:
+        _device_state.update(profile=profile, antidetect_enabled=True)
     
     return jsonify({
         "success": True,
         "profile": profile,
-        "hardware_ids": _device_state["hardware_ids"],
+        "hardware_ids": ids,
         "properties_applied": len(applied_props)
     })
 
@@ -953,9 +1789,7 @@ def list_profiles():
     """List available device profiles"""
     profiles = []
     if os.path.exists(PROFILES_DIR):
-        for f in os.listdir(PROFILES_DIR):
-            if f.endswith('.prop'):
-                profiles.append(f.replace('.prop', ''))
+        profiles = list(_profile_names(PROFILES_DIR, os.stat(PROFILES_DIR).st_mtime_ns))
     
     return jsonify({
         "profiles": profiles,
@@ -966,19 +1800,21 @@ def list_profiles():
 @require_auth
 def generate_new_ids():
     """Generate new random hardware identifiers"""
-    _device_state["hardware_ids"] = {
+    ids = {
         "imei": generate_imei(),
         "imei2": generate_imei(),
         "serial": generate_serial(),
         "mac_wifi": generate_mac(),
         "mac_bt": generate_mac(),
         "android_id": generate_android_id(),
-        "advertising_id": str(__import__('uuid').uuid4())
+        "advertising_id": str(uuid.uuid4())
     }
+    with _STATE_LOCK:
+        _device_state["hardware_ids"] = ids
     
     return jsonify({
         "success": True,
-        "hardware_ids": _device_state["hardware_ids"]
+        "hardware_ids": ids
     })
 
 @app.route("/device/antidetect", methods=["POST"])
@@ -1001,6 +1837,9 @@ def apply_antidetect():
     hide_emulator = data.get("hide_emulator", True)
     spoof_battery = data.get("spoof_battery", True)
     
+    if not isinstance(profile, str):
+        return jsonify({"error": "profile must be a string"}), 400
+    
     ensure_adb_connected()
     results = []
     
@@ -1017,37 +1856,32 @@ def apply_antidetect():
         set_result = set_device_identity()
         results.append({"action": "profile", "success": True})
     
+    # Remaining steps are collected and sent as one script
+    commands = []
+    
     # Hide emulator artifacts
     if hide_emulator:
-        emulator_props = [
-            ("ro.kernel.qemu", "0"),
-            ("ro.hardware.virtual_device", "0"),
-            ("ro.boot.qemu", "0"),
-            ("qemu.hw.mainkeys", "0")
-        ]
-        for key, value in emulator_props:
-            run_adb_shell(f"setprop {key} '{value}'")
+        commands += _HIDE_EMULATOR_CMDS
         results.append({"action": "hide_emulator", "success": True})
     
     # Hide root/debug
     if hide_root:
-        run_adb_shell("setprop ro.debuggable 0")
-        run_adb_shell("setprop ro.secure 1")
-        run_adb_shell("setprop ro.boot.verifiedbootstate green")
-        run_adb_shell("setprop ro.boot.flash.locked 1")
+        commands += _HIDE_ROOT_CMDS
         results.append({"action": "hide_root", "success": True})
     
     # Spoof battery
     if spoof_battery:
-        import random
         level = random.randint(45, 85)
-        run_adb_shell(f"dumpsys battery set level {level}")
-        run_adb_shell("dumpsys battery set status 3")  # Not charging
-        run_adb_shell("dumpsys battery set ac 0")
-        run_adb_shell("dumpsys battery set usb 0")
+        commands.append(f"dumpsys battery set level {level}")
+        commands += _SPOOF_BATTERY_CMDS
         results.append({"action": "spoof_battery", "success": True, "level": level})
     
-    _device_state["antidetect_enabled"] = True
+    if commands:
+        run_adb_shell("\n".join(commands))
+    
+    invalidate_shell_cache()
+    with _STATE_LOCK:
+        _device_state["antidetect_enabled"] = True
     
     return jsonify({
         "success": True,
@@ -1061,23 +1895,16 @@ def antidetect_status():
     """Check anti-detection status"""
     ensure_adb_connected()
     
-    checks = {}
-    
-    # Check debuggable
-    _, val, _ = run_adb_shell("getprop ro.debuggable")
-    checks["debuggable"] = val != "1"
+    props = multi_getprop([
+        "ro.debuggable", "ro.kernel.qemu", "ro.boot.verifiedbootstate", "ro.build.type"
+    ])
     
-    # Check qemu
-    _, val, _ = run_adb_shell("getprop ro.kernel.qemu")
-    checks["qemu_hidden"] = val != "1"
-    
-    # Check boot state
-    _, val, _ = run_adb_shell("getprop ro.boot.verifiedbootstate")
-    checks["boot_state_green"] = val == "green"
-    
-    # Check build type
-    _, val, _ = run_adb_shell("getprop ro.build.type")
-    checks["user_build"] = val == "user"
+    checks = {
+        "debuggable": props["ro.debuggable"] != "1",
+        "qemu_hidden": props["ro.kernel.qemu"] != "1",
+        "boot_state_green": props["ro.boot.verifiedbootstate"] == "green",
+        "user_build": props["ro.build.type"] == "user",
+    }
     
     # Overall score
     passed = sum(1 for v in checks.values() if v)
@@ -1102,9 +1929,10 @@ def reset_antidetect():
     
     # Re-enable debug
     run_adb_shell("setprop ro.debuggable 1")
+    invalidate_shell_cache()
     
-    _device_state["antidetect_enabled"] = False
-    _device_state["profile"] = None
+    with _STATE_LOCK:
+        _device_state.update(antidetect_enabled=False, profile=None)
     
     return jsonify({
         "success": True,
@@ -1181,4 +2009,36 @@ if __name__ == "__main__":
     print(f"Starting Cloud Phone Control API on {host}:{port}")
     print(f"ADB target: {ADB_CONNECT}")
     
+    # Start the adb server up front so the first request doesn't pay for it
+    try:
+        subprocess.run(["adb", "start-server"], capture_output=True, timeout=30)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logger.warning("adb start-server failed: %s", e)
+    
+    # Production: hand over to gunicorn. One worker by default since jobs,
+    # proxy/location state and the ADB session are per-process. gevent (the
+    # default when installed) multiplexes long adb waits on one thread;
+    # gthread runs API_WORKER_THREADS threads.
+    if not debug and os.environ.get("API_SERVER", "gunicorn") == "gunicorn" and shutil.which("gunicorn"):
+        here = os.path.dirname(os.path.abspath(__file__))
+        module = os.path.splitext(os.path.basename(__file__))[0]
+        try:
+            import gevent  # noqa: F401
+            worker_class = "gevent"
+        except ImportError:
+            worker_class = "gthread"
+        uds = os.environ.get("API_UDS")
+        os.execvp("gunicorn", [
+            "gunicorn", "--chdir", here,
+            "-b", f"{host}:{port}",
+            *(["-b", f"unix:{uds}"] if uds else []),
+            "-w", os.environ.get("API_WORKERS", "1"),
+            "-k", os.environ.get("API_WORKER_CLASS", worker_class),
+            "--threads", os.environ.get("API_WORKER_THREADS", "8"),
+            "--worker-connections", os.environ.get("API_WORKER_CONNECTIONS", "1000"),
+            "--timeout", os.environ.get("API_WORKER_TIMEOUT", "120"),
+            "--keep-alive", os.environ.get("API_KEEPALIVE", "30"),
+            f"{module}:app"
+        ])
+    
     app.run(host=host, port=port, debug=debug, threaded=True)
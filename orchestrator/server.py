@@ -8,20 +8,52 @@ Features:
 - Relay commands to Control API
 """
 
+import os
+
+# Cooperative I/O for direct runs (gunicorn's gevent worker patches on its own)
+if os.environ.get("USE_GEVENT"):
+    from gevent import monkey
+    monkey.patch_all()
+
 import json
 import logging
-import os
+import shutil
 import subprocess
 import threading
 import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import requests
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# orjson speeds up instance/operation listings and request parsing when
+# installed (flask>=2.2 provider API); stdlib json otherwise
+try:
+    import orjson
+    from flask.json.provider import DefaultJSONProvider
+except ImportError:
+    orjson = None
 
 app = Flask(__name__)
 
+if orjson is not None:
+    _ORJSON_OPTS = orjson.OPT_NON_STR_KEYS | orjson.OPT_NAIVE_UTC
+
+    class OrjsonProvider(DefaultJSONProvider):
+        """Flask JSON provider backed by orjson (also parses request bodies)"""
+
+        def dumps(self, obj, **kwargs):
+            return orjson.dumps(obj, option=_ORJSON_OPTS, default=self.default).decode()
+
+        def loads(self, s, **kwargs):
+            return orjson.loads(s)
+
+    app.json = OrjsonProvider(app)
+
 # Logging
 LOG_LEVEL = os.environ.get("ORCH_LOG_LEVEL", "INFO").upper()
 logging.basicConfig(
@@ -45,14 +77,37 @@ ORCH_DEPLOY_SCRIPT = os.environ.get(
 ORCH_OCI_PROFILE = os.environ.get("ORCH_OCI_PROFILE", "redroid-cloud-phone")
 ORCH_OCI_CONFIG = os.environ.get("ORCH_OCI_CONFIG", str(Path.home() / ".oci" / "config"))
 ORCH_OCI_AUTH = os.environ.get("ORCH_OCI_AUTH", "security_token")
+ORCH_HTTP_POOL_SIZE = int(os.environ.get("ORCH_HTTP_POOL_SIZE", "32"))
+ORCH_PROVISION_CONCURRENCY = int(os.environ.get("ORCH_PROVISION_CONCURRENCY", "4"))
+ORCH_STATUS_CACHE_TTL = float(os.environ.get("ORCH_STATUS_CACHE_TTL", "1"))
+ORCH_OP_WORKERS = int(os.environ.get("ORCH_OP_WORKERS", "16"))
 
-# In-memory state
+# In-memory state. Single-key dict reads/writes are atomic, so read paths
+# don't lock; the locks only guard check-then-write sequences.
 _instances = {}
 _instances_lock = threading.Lock()
+_provisioning = 0  # provisions in flight, counted against ORCH_MAX_INSTANCES
 _ops = {}
-_ops_lock = threading.Lock()
-_leases = {}
+_leases = {}  # instance_id -> {"owner", "expires_at" (time.monotonic())}
 _leases_lock = threading.Lock()
+_status_cache = {}  # (api_url, path) -> (time.monotonic() of fetch, raw response)
+
+# Operations beyond ORCH_OP_WORKERS wait in the pool's queue (status "queued")
+_op_pool = ThreadPoolExecutor(max_workers=ORCH_OP_WORKERS, thread_name_prefix="op")
+
+# Shared keep-alive connections to the Control APIs. Connection failures and
+# 502/503/504 on GETs are retried; POSTs (taps, text) are never resent once sent.
+_session = requests.Session()
+_adapter = HTTPAdapter(
+    pool_connections=ORCH_HTTP_POOL_SIZE,
+    pool_maxsize=ORCH_HTTP_POOL_SIZE,
+    max_retries=Retry(total=3, backoff_factor=0.2, status_forcelist=[502, 503, 504],
+                      allowed_methods=["GET"], raise_on_status=False)
+)
+_session.mount("http://", _adapter)
+_session.mount("https://", _adapter)
+
+
 def _require_auth():
     if not ORCH_API_TOKEN:
         return None
@@ -84,15 +139,14 @@ def _normalize_steps(steps):
 
 
 def _get_lease(instance_id):
-    with _leases_lock:
-        return _leases.get(instance_id)
+    return _leases.get(instance_id)
 
 
 def _set_lease(instance_id, owner, ttl_seconds):
     with _leases_lock:
         _leases[instance_id] = {
             "owner": owner,
-            "expires_at": time.time() + ttl_seconds
+            "expires_at": time.monotonic() + ttl_seconds
         }
 
 
@@ -101,11 +155,25 @@ def _clear_lease(instance_id):
         _leases.pop(instance_id, None)
 
 
+def _try_lease(instance_id, owner, ttl_seconds):
+    """Take the lease unless someone holds an unexpired one."""
+    now = time.monotonic()
+    with _leases_lock:
+        lease = _leases.get(instance_id)
+        if lease and lease["expires_at"] >= now:
+            return False
+        _leases[instance_id] = {
+            "owner": owner,
+            "expires_at": now + ttl_seconds
+        }
+    return True
+
+
 def _is_lease_valid(instance_id, owner=None):
     lease = _get_lease(instance_id)
     if not lease:
         return False
-    if lease["expires_at"] < time.time():
+    if lease["expires_at"] < time.monotonic():
         _clear_lease(instance_id)
         return False
     if owner and lease["owner"] != owner:
@@ -123,7 +191,7 @@ def _control_headers():
 def _control_post(api_url: str, path: str, payload=None):
     url = f"{api_url}{path}"
     logger.info("Control POST %s payload=%s", url, payload)
-    resp = requests.post(url, json=payload, headers=_control_headers(), timeout=ORCH_API_TIMEOUT)
+    resp = _session.post(url, json=payload, headers=_control_headers(), timeout=ORCH_API_TIMEOUT)
     resp.raise_for_status()
     return resp.json()
 
@@ -131,19 +199,65 @@ def _control_post(api_url: str, path: str, payload=None):
 def _control_get(api_url: str, path: str):
     url = f"{api_url}{path}"
     logger.info("Control GET %s", url)
-    resp = requests.get(url, headers=_control_headers(), timeout=ORCH_API_TIMEOUT)
+    resp = _session.get(url, headers=_control_headers(), timeout=ORCH_API_TIMEOUT)
     resp.raise_for_status()
     return resp.json()
 
 
+def _control_get_raw(api_url: str, path: str):
+    """GET returning (body bytes, content type) without decoding the JSON."""
+    url = f"{api_url}{path}"
+    logger.info("Control GET %s", url)
+    resp = _session.get(url, headers=_control_headers(), timeout=ORCH_API_TIMEOUT)
+    resp.raise_for_status()
+    return resp.content, resp.headers.get("Content-Type", "application/json")
+
+
+def _control_stream(api_url: str, path: str, chunk_size: int = 64 * 1024):
+    """Stream a GET response through as it arrives (binary downloads)."""
+    url = f"{api_url}{path}"
+    logger.info("Control GET %s (stream)", url)
+    resp = _session.get(url, headers=_control_headers(), timeout=ORCH_API_TIMEOUT, stream=True)
+    try:
+        resp.raise_for_status()
+    except requests.HTTPError:
+        resp.close()
+        raise
+
+    def generate():
+        try:
+            yield from resp.iter_content(chunk_size)
+        finally:
+            resp.close()
+
+    return Response(generate(), content_type=resp.headers.get("Content-Type", "application/octet-stream"))
+
+
+def _passthrough(raw):
+    body, content_type = raw
+    return Response(body, content_type=content_type)
+
+
+def _cached_control_get_raw(api_url: str, path: str):
+    """_control_get_raw, reusing a response younger than ORCH_STATUS_CACHE_TTL."""
+    key = (api_url, path)
+    cached = _status_cache.get(key)
+    if cached and time.monotonic() - cached[0] < ORCH_STATUS_CACHE_TTL:
+        return cached[1]
+    raw = _control_get_raw(api_url, path)
+    _status_cache[key] = (time.monotonic(), raw)
+    return raw
+
+
 def _create_instance_record(api_url: str, name: str):
     inst_id = uuid.uuid4().hex
+    now = time.time()
     record = {
         "id": inst_id,
         "name": name,
         "api_url": api_url,
-        "created_at": time.time(),
-        "last_used": time.time(),
+        "created_at": now,
+        "last_used": now,
         "mode": ORCH_DEPLOY_MODE,
         "instance_ocid": None,
     }
@@ -153,11 +267,20 @@ def _create_instance_record(api_url: str, name: str):
     return record
 
 
-def _provision_instance():
+def _provision_instance(index=None):
+    global _provisioning
     with _instances_lock:
-        if len(_instances) >= ORCH_MAX_INSTANCES:
+        if len(_instances) + _provisioning >= ORCH_MAX_INSTANCES:
             raise RuntimeError(f"Instance limit reached (ORCH_MAX_INSTANCES={ORCH_MAX_INSTANCES})")
+        _provisioning += 1
+    try:
+        return _deploy_instance(index)
+    finally:
+        with _instances_lock:
+            _provisioning -= 1
+
 
+def _deploy_instance(index=None):
     if ORCH_DEPLOY_MODE == "mock":
         name = f"{ORCH_INSTANCE_NAME_PREFIX}-mock"
         logger.info("Mock provisioning instance -> %s", ORCH_MOCK_API_URL)
@@ -170,6 +293,9 @@ def _provision_instance():
         raise RuntimeError("GOLDEN_IMAGE_ID required for OCI provisioning")
 
     name = f"{ORCH_INSTANCE_NAME_PREFIX}-{time.strftime('%Y%m%d-%H%M%S')}"
+    if index is not None:
+        # Bulk provisions start within the same second
+        name = f"{name}-{index}"
     cmd = [ORCH_DEPLOY_SCRIPT, "--image-id", ORCH_GOLDEN_IMAGE_ID, "--name", name, "--wait-check"]
     logger.info("Provisioning instance via OCI: %s", " ".join(cmd))
     subprocess.check_call(cmd)
@@ -220,32 +346,34 @@ def _get_or_create_instance(instance_id=None):
     return _provision_instance()
 
 
+def _exec_step(api_url: str, step):
+    action = step.get("action")
+    logger.info("Executing step action=%s payload=%s", action, step)
+    if action == "start_app":
+        package = step.get("package")
+        if not package:
+            raise ValueError("start_app requires package")
+        return _control_post(api_url, f"/apps/{package}/start")
+    if action == "input_text":
+        text = step.get("text", "")
+        return _control_post(api_url, "/device/input", {"type": "text", "text": text})
+    if action == "key":
+        keycode = int(step.get("keycode", 66))
+        return _control_post(api_url, "/device/input", {"type": "key", "keycode": keycode})
+    if action == "tap":
+        x = int(step.get("x", 500))
+        y = int(step.get("y", 500))
+        return _control_post(api_url, "/device/input", {"type": "tap", "x": x, "y": y})
+    if action == "sleep_ms":
+        time.sleep(int(step.get("duration", 500)) / 1000.0)
+        return {"success": True, "sleep_ms": step.get("duration", 500)}
+    raise ValueError(f"Unsupported action: {action}")
+
+
 def _run_steps(api_url: str, steps):
-    results = []
-    for step in steps:
-        action = step.get("action")
-        logger.info("Executing step action=%s payload=%s", action, step)
-        if action == "start_app":
-            package = step.get("package")
-            if not package:
-                raise ValueError("start_app requires package")
-            results.append(_control_post(api_url, f"/apps/{package}/start"))
-        elif action == "input_text":
-            text = step.get("text", "")
-            results.append(_control_post(api_url, "/device/input", {"type": "text", "text": text}))
-        elif action == "key":
-            keycode = int(step.get("keycode", 66))
-            results.append(_control_post(api_url, "/device/input", {"type": "key", "keycode": keycode}))
-        elif action == "tap":
-            x = int(step.get("x", 500))
-            y = int(step.get("y", 500))
-            results.append(_control_post(api_url, "/device/input", {"type": "tap", "x": x, "y": y}))
-        elif action == "sleep_ms":
-            time.sleep(int(step.get("duration", 500)) / 1000.0)
-            results.append({"success": True, "sleep_ms": step.get("duration", 500)})
-        else:
-            raise ValueError(f"Unsupported action: {action}")
-    return results
+    # Strictly in order: every step acts on the same device UI (focus, typed
+    # text, foreground app), so overlapping them would reorder the gestures
+    return [_exec_step(api_url, step) for step in steps]
 
 
 def _build_login_steps(payload):
@@ -274,12 +402,13 @@ def _build_login_steps(payload):
 
 
 def _run_operation(op_id, payload):
-    with _ops_lock:
-        op = _ops.get(op_id)
-        if not op:
-            return
-        op["status"] = "running"
-        op["updated_at"] = time.time()
+    # Status is written last so pollers never see "done"/"failed" without
+    # the result/error that goes with it
+    op = _ops.get(op_id)
+    if not op:
+        return
+    op["updated_at"] = time.time()
+    op["status"] = "running"
 
     try:
         logger.info("Operation started id=%s payload=%s", op_id, payload)
@@ -293,17 +422,15 @@ def _run_operation(op_id, payload):
             steps = _build_login_steps(payload)
         results = _run_steps(api_url, steps)
 
-        with _ops_lock:
-            op["status"] = "done"
-            op["result"] = {"steps": steps, "results": results, "instance": instance}
-            op["updated_at"] = time.time()
+        op["result"] = {"steps": steps, "results": results, "instance": instance}
+        op["updated_at"] = time.time()
+        op["status"] = "done"
         logger.info("Operation complete id=%s status=done", op_id)
     except Exception as exc:
         logger.exception("Operation failed")
-        with _ops_lock:
-            op["status"] = "failed"
-            op["error"] = str(exc)
-            op["updated_at"] = time.time()
+        op["error"] = str(exc)
+        op["updated_at"] = time.time()
+        op["status"] = "failed"
 
 
 @app.route("/operations", methods=["POST"])
@@ -315,27 +442,25 @@ def create_operation():
         return jsonify({"error": "app_package required for login operation"}), 400
 
     op_id = uuid.uuid4().hex
+    now = time.time()
     op = {
         "id": op_id,
         "status": "queued",
-        "created_at": time.time(),
-        "updated_at": time.time(),
+        "created_at": now,
+        "updated_at": now,
         "payload": payload
     }
-    with _ops_lock:
-        _ops[op_id] = op
+    _ops[op_id] = op
     logger.info("Queued operation id=%s", op_id)
 
-    thread = threading.Thread(target=_run_operation, args=(op_id, payload), daemon=True)
-    thread.start()
+    _op_pool.submit(_run_operation, op_id, payload)
 
     return jsonify({"operation_id": op_id, "status": "queued"}), 202
 
 
 @app.route("/operations/<op_id>", methods=["GET"])
 def get_operation(op_id):
-    with _ops_lock:
-        op = _ops.get(op_id)
+    op = _ops.get(op_id)
     if not op:
         return jsonify({"error": "operation not found"}), 404
     return jsonify(op)
@@ -343,8 +468,7 @@ def get_operation(op_id):
 
 @app.route("/instances", methods=["GET"])
 def list_instances():
-    with _instances_lock:
-        return jsonify(list(_instances.values()))
+    return jsonify(list(_instances.values()))
 
 
 @app.route("/instances", methods=["POST"])
@@ -353,10 +477,35 @@ def create_instance():
     return jsonify(inst), 201
 
 
+@app.route("/instances/bulk", methods=["POST"])
+def create_instances_bulk():
+    data = request.get_json() or {}
+    try:
+        count = int(data.get("count", 1))
+    except (TypeError, ValueError):
+        return jsonify({"error": "count must be an integer"}), 400
+    if count < 1 or count > ORCH_MAX_INSTANCES:
+        return jsonify({"error": f"count must be between 1 and {ORCH_MAX_INSTANCES}"}), 400
+
+    def provision(index):
+        try:
+            return _provision_instance(index), None
+        except Exception as exc:
+            logger.exception("Bulk provisioning failed index=%s", index)
+            return None, str(exc)
+
+    # Each provision is independent; run up to ORCH_PROVISION_CONCURRENCY at once
+    with ThreadPoolExecutor(max_workers=min(count, ORCH_PROVISION_CONCURRENCY)) as pool:
+        results = list(pool.map(provision, range(1, count + 1)))
+
+    created = [inst for inst, _ in results if inst]
+    errors = [err for _, err in results if err]
+    return jsonify({"instances": created, "errors": errors}), 201 if created else 500
+
+
 @app.route("/instances/<instance_id>", methods=["DELETE"])
 def delete_instance(instance_id):
-    with _instances_lock:
-        inst = _instances.get(instance_id)
+    inst = _instances.get(instance_id)
     if not inst:
         return jsonify({"error": "instance not found"}), 404
     if inst.get("mode") != "oci":
@@ -380,9 +529,8 @@ def lease_instance(instance_id):
     ttl = int(data.get("ttl_seconds", 300))
     if ttl < 10:
         return jsonify({"error": "ttl_seconds must be >= 10"}), 400
-    if _is_lease_valid(instance_id):
+    if not _try_lease(instance_id, owner, ttl):
         return jsonify({"error": "instance already leased"}), 409
-    _set_lease(instance_id, owner, ttl)
     return jsonify({"success": True, "instance_id": instance_id, "owner": owner, "ttl_seconds": ttl})
 
 
@@ -393,8 +541,7 @@ def release_instance(instance_id):
 
 
 def _require_instance(instance_id):
-    with _instances_lock:
-        inst = _instances.get(instance_id)
+    inst = _instances.get(instance_id)
     if not inst:
         return None, (jsonify({"error": "instance not found"}), 404)
     return inst, None
@@ -405,8 +552,7 @@ def phone_status(instance_id):
     inst, err = _require_instance(instance_id)
     if err:
         return err
-    data = _control_get(inst["api_url"], "/status")
-    return jsonify(data)
+    return _passthrough(_cached_control_get_raw(inst["api_url"], "/status"))
 
 
 @app.route("/phones/<instance_id>/health", methods=["GET"])
@@ -414,8 +560,7 @@ def phone_health(instance_id):
     inst, err = _require_instance(instance_id)
     if err:
         return err
-    data = _control_get(inst["api_url"], "/health")
-    return jsonify(data)
+    return _passthrough(_cached_control_get_raw(inst["api_url"], "/health"))
 
 
 @app.route("/phones/<instance_id>/input", methods=["POST"])
@@ -435,8 +580,15 @@ def phone_screenshot(instance_id):
     inst, err = _require_instance(instance_id)
     if err:
         return err
-    data = _control_get(inst["api_url"], "/device/screenshot/base64")
-    return jsonify(data)
+    return _passthrough(_control_get_raw(inst["api_url"], "/device/screenshot/base64"))
+
+
+@app.route("/phones/<instance_id>/screenshot.png", methods=["GET"])
+def phone_screenshot_png(instance_id):
+    inst, err = _require_instance(instance_id)
+    if err:
+        return err
+    return _control_stream(inst["api_url"], "/device/screenshot")
 
 
 @app.route("/phones/<instance_id>/jobs", methods=["POST"])
@@ -454,8 +606,7 @@ def phone_job_poll(instance_id, job_id):
     inst, err = _require_instance(instance_id)
     if err:
         return err
-    data = _control_get(inst["api_url"], f"/jobs/{job_id}")
-    return jsonify(data)
+    return _passthrough(_control_get_raw(inst["api_url"], f"/jobs/{job_id}"))
 
 
 @app.route("/health", methods=["GET"])
@@ -467,4 +618,27 @@ if __name__ == "__main__":
     host = os.environ.get("ORCH_HOST", "0.0.0.0")
     port = int(os.environ.get("ORCH_PORT", "8090"))
     logger.info("Starting orchestrator on %s:%s (mode=%s)", host, port, ORCH_DEPLOY_MODE)
+
+    # Production: hand over to gunicorn. One worker, since instances,
+    # operations and leases live in process memory. The orchestrator mostly
+    # waits on Control API calls, which gevent (the default when installed)
+    # multiplexes on one thread; gthread runs ORCH_WORKER_THREADS threads.
+    if os.environ.get("ORCH_SERVER", "gunicorn") == "gunicorn" and shutil.which("gunicorn"):
+        try:
+            import gevent  # noqa: F401
+            worker_class = "gevent"
+        except ImportError:
+            worker_class = "gthread"
+        os.execvp("gunicorn", [
+            "gunicorn", "--chdir", os.path.dirname(os.path.abspath(__file__)),
+            "-b", f"{host}:{port}",
+            "-w", "1",
+            "-k", os.environ.get("ORCH_WORKER_CLASS", worker_class),
+            "--threads", os.environ.get("ORCH_WORKER_THREADS", "16"),
+            "--worker-connections", os.environ.get("ORCH_WORKER_CONNECTIONS", "1000"),
+            "--timeout", os.environ.get("ORCH_WORKER_TIMEOUT", "120"),
+            "--keep-alive", os.environ.get("ORCH_KEEPALIVE", "30"),
+            "server:app"
+        ])
+
     app.run(host=host, port=port, threaded=True)
@@ -18,6 +18,9 @@ from pathlib import Path
 
 import requests
 
+# One keep-alive connection for all requests (watch-health reuses it)
+_session = requests.Session()
+
 
 def build_headers(token: str) -> dict:
     headers = {"Content-Type": "application/json"}
@@ -27,7 +30,7 @@ def build_headers(token: str) -> dict:
 
 
 def request_json(method: str, url: str, headers: dict, data=None, timeout=30):
-    resp = requests.request(method, url, headers=headers, json=data, timeout=timeout)
+    resp = _session.request(method, url, headers=headers, json=data, timeout=timeout)
     resp.raise_for_status()
     return resp.json()
 
@@ -114,7 +117,7 @@ def main():
                                 {"action": args.action}, args.timeout)
             print(json.dumps(data, indent=2))
         elif args.command == "screenshot":
-            resp = requests.get(f"{base}/device/screenshot", headers=headers, timeout=args.timeout)
+            resp = _session.get(f"{base}/device/screenshot", headers=headers, timeout=args.timeout)
             resp.raise_for_status()
             out = Path(args.out)
             out.write_bytes(resp.content)
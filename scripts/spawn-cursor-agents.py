@@ -11,6 +11,7 @@ import base64
 import json
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
 
@@ -25,6 +26,7 @@ def main():
     parser.add_argument("--endpoint", required=True, help="Full Cloud Agents create endpoint URL")
     parser.add_argument("--count", type=int, default=2, help="Number of agents to create")
     parser.add_argument("--payload", default="{}", help="JSON payload for agent creation")
+    parser.add_argument("--parallel", type=int, default=8, help="Max concurrent create requests")
     args = parser.parse_args()
 
     api_key = os.environ.get("CURSOR_API_KEY")
@@ -43,16 +45,27 @@ def main():
         print(f"Invalid JSON payload: {exc}", file=sys.stderr)
         return 1
 
-    created = []
-    for i in range(args.count):
-        resp = requests.post(args.endpoint, headers=headers, json=payload, timeout=30)
+    def create(i):
+        try:
+            resp = requests.post(args.endpoint, headers=headers, json=payload, timeout=30)
+        except requests.RequestException as exc:
+            return None, f"Failed to create agent {i+1}: {exc}"
         if resp.status_code >= 300:
-            print(f"Failed to create agent {i+1}: {resp.status_code} {resp.text}", file=sys.stderr)
-            return 1
-        created.append(resp.json())
+            return None, f"Failed to create agent {i+1}: {resp.status_code} {resp.text}"
+        return resp.json(), None
+
+    # Creates are independent; send them concurrently and report every failure
+    workers = max(1, min(args.count, args.parallel))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(create, range(args.count)))
+
+    created = [agent for agent, _ in results if agent is not None]
+    errors = [err for _, err in results if err]
+    for err in errors:
+        print(err, file=sys.stderr)
 
     print(json.dumps({"created": created}, indent=2))
-    return 0
+    return 1 if errors else 0
 
 
 if __name__ == "__main__":
@@ -242,6 +242,14 @@ class TestSuite:
         data = self.client.check_response(resp)
         assert data.get("stdout", "").strip() != ""
 
+    def test_adb_batch(self):
+        resp = self.client.post("/adb/batch", {"commands": ["echo one", "false", "echo two"]})
+        assert resp.status_code == 200
+        results = resp.json().get("results", [])
+        assert [r["success"] for r in results] == [True, False, True]
+        assert results[0]["stdout"] == "one"
+        assert results[2]["stdout"] == "two"
+
     def test_config_get(self):
         resp = self.client.get("/config")
         assert resp.status_code == 200
@@ -263,6 +271,7 @@ class TestSuite:
             ("start_stop_settings", self.test_start_stop_settings),
             ("adb_shell", self.test_adb_shell),
             ("adb_getprop", self.test_adb_getprop),
+            ("adb_batch", self.test_adb_batch),
             ("config_get", self.test_config_get),
         ]
 
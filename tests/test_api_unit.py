@@ -0,0 +1,614 @@
+#!/usr/bin/env python3
+"""
+Unit tests for Control API / Agent API helpers.
+
+No device needed: shell commands run in a local sh, via a fake `adb` on
+PATH or a patched run_adb_shell.
+"""
+
+import base64
+import io
+import json
+import os
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import Mock, patch
+
+# api/ isn't a package; agent_api logs to LOG_DIR at import
+_TMP = tempfile.mkdtemp(prefix="api-unit-")
+os.environ.setdefault("LOG_DIR", _TMP)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "api"))
+
+import agent_api  # noqa: E402
+import server  # noqa: E402
+
+
+# `adb -s <target> shell|exec-in|exec-out ...` -> local sh. exec-out replaces
+# the script with the command, so killing "adb" closes its stdout like real adb
+_FAKE_ADB = """#!/bin/sh
+while [ "$1" = "-s" ] || [ "$1" = "-t" ]; do shift 2; done
+case "$1" in
+    exec-out) shift; eval "exec $*";;
+    shell|exec-in) shift;;
+esac
+if [ $# -eq 0 ]; then exec sh; fi
+exec sh -c "$*"
+"""
+
+
+def _use_fake_adb(test):
+    """Put _FAKE_ADB first on PATH for the duration of test"""
+    bin_dir = os.path.join(_TMP, "bin")
+    os.makedirs(bin_dir, exist_ok=True)
+    adb = os.path.join(bin_dir, "adb")
+    with open(adb, "w") as f:
+        f.write(_FAKE_ADB)
+    os.chmod(adb, 0o755)
+    patcher = patch.dict(os.environ, {"PATH": bin_dir + os.pathsep + os.environ.get("PATH", "")})
+    patcher.start()
+    test.addCleanup(patcher.stop)
+
+
+def _local_shell(command, timeout=30):
+    """run_adb_shell stand-in that runs command in a local sh"""
+    result = subprocess.run(["sh", "-c", command], capture_output=True, text=True, timeout=timeout)
+    return result.returncode == 0, result.stdout.strip(), result.stderr.strip()
+
+
+class ShellSessionTests(unittest.TestCase):
+    def setUp(self):
+        _use_fake_adb(self)
+        self.session = server._AdbShellSession("fake:5555")
+        self.addCleanup(self.session.close)
+
+    def test_output_and_exit_code_framing(self):
+        success, out, err = self.session.run("echo out; echo err >&2; exit 3")
+        self.assertFalse(success)
+        self.assertEqual(out, "out")
+        self.assertEqual(err, "err")
+        # `exit` ran in a subshell: same session, next command framed correctly
+        pid = self.session.proc.pid
+        self.assertEqual(self.session.run("printf abc"), (True, "abc", ""))
+        self.assertEqual(self.session.proc.pid, pid)
+
+    def test_timeout_respawns_session(self):
+        success, _, err = self.session.run("sleep 5", timeout=0.5)
+        self.assertFalse(success)
+        self.assertEqual(err, "Command timed out")
+        self.assertFalse(self.session.alive())
+        self.assertEqual(self.session.run("echo again"), (True, "again", ""))
+
+
+class ShellBatchTests(unittest.TestCase):
+    def test_batch_splits_results(self):
+        with patch.object(server, "run_adb_shell", side_effect=_local_shell):
+            results = server.run_adb_shell_batch(
+                ["echo a; echo b", "echo oops >&2; false", "printf c"])
+        self.assertEqual(results, [(True, "a\nb", ""), (False, "", "oops"), (True, "c", "")])
+
+    def test_stop_on_error_skips_rest(self):
+        with patch.object(server, "run_adb_shell", side_effect=_local_shell):
+            results = server.run_adb_shell_batch(
+                ["echo a", "false", "echo c"], stop_on_error=True)
+        self.assertEqual(results, [(True, "a", ""), (False, "", ""), (False, "", "skipped")])
+
+    def test_aborted_batch(self):
+        with patch.object(server, "run_adb_shell", return_value=(False, "", "Command timed out")):
+            results = server.run_adb_shell_batch(["echo a", "echo b"])
+        self.assertEqual(results, [(False, "", "Command timed out")] * 2)
+
+
+class ProfileTests(unittest.TestCase):
+    def test_prop_re_parses_profile_lines(self):
+        text = (
+            "# comment\n"
+            "\n"
+            "ro.product.model=Pixel 6\n"
+            "  ro.product.brand = google  \r\n"
+            "ro.build.fingerprint=google/oriole:12/SD1A=x:user\n"
+            "#ro.disabled=1\n"
+        )
+        self.assertEqual(server._PROP_RE.findall(text), [
+            ("ro.product.model", "Pixel 6"),
+            ("ro.product.brand", "google"),
+            ("ro.build.fingerprint", "google/oriole:12/SD1A=x:user"),
+        ])
+
+
+class ConnectionTests(unittest.TestCase):
+    def test_device_listed(self):
+        devices = (
+            "List of devices attached\n"
+            "emulator-5554          device product:sdk model:sdk transport_id:1\n"
+            "127.0.0.1:5555         device product:redroid model:redroid transport_id:7\n"
+        )
+        with patch.object(server, "ADB_CONNECT", "127.0.0.1:5555"):
+            self.assertEqual(server._device_listed(devices), (True, "7"))
+            self.assertEqual(server._device_listed("127.0.0.1:5555 offline\n"), (False, None))
+            self.assertEqual(server._device_listed("List of devices attached\n"), (False, None))
+
+
+class AgentInputTests(unittest.TestCase):
+    def test_input_action_commands(self):
+        commands = agent_api.input_action_commands([
+            {"action": "tap", "x": 5, "y": 6},
+            {"action": "swipe", "x1": 1, "y1": 2, "x2": 3, "y2": 4, "duration": 100},
+            {"action": "long_press", "x": 7, "y": 8},
+            {"action": "key", "key": "KEYCODE_HOME; reboot"},
+            {"action": "wait", "ms": 250},
+        ])
+        self.assertEqual(commands, [
+            "input tap 5 6",
+            "input swipe 1 2 3 4 100",
+            "input swipe 7 8 7 8 1000",
+            "input keyevent 'KEYCODE_HOME; reboot'",
+            "sleep 0.250",
+        ])
+
+    def test_input_action_commands_errors(self):
+        with self.assertRaisesRegex(ValueError, r"^actions\[1\]: unknown action 'fling'"):
+            agent_api.input_action_commands([{"action": "tap"}, {"action": "fling"}])
+        with self.assertRaisesRegex(ValueError, r"^actions\[0\]: "):
+            agent_api.input_action_commands([{"action": "wait", "ms": "soon"}])
+
+    def test_input_text_command_runs_in_sh(self):
+        # Fallback branch (no ADBKeyboard): the quoted text survives sh intact
+        command = agent_api.input_text_command("it's a & b")
+        script = command.replace("settings get secure default_input_method", "echo none")
+        script = script.replace("input text ", "printf %s ")
+        self.assertEqual(_local_shell(script)[1], "it's%sa%s\\&%sb")
+
+
+class DeviceInputTests(unittest.TestCase):
+    def test_device_input_commands(self):
+        with patch.object(server, "run_adb_shell", return_value=(True, "", "")) as shell:
+            server._do_device_input({"type": "tap", "x": 10, "y": 20})
+            server._do_device_input({"type": "swipe", "x1": 1, "y1": 2, "x2": 3, "y2": 4})
+            server._do_device_input({"type": "key", "keycode": 66})
+        self.assertEqual([c.args[0] for c in shell.call_args_list], [
+            "input tap 10 20", "input swipe 1 2 3 4 300", "input keyevent 66"])
+
+    def test_device_input_rejects_bad_values(self):
+        with patch.object(server, "run_adb_shell") as shell:
+            self.assertFalse(server._do_device_input({"type": "tap", "x": "1; reboot"})["success"])
+            self.assertFalse(server._do_device_input({"type": "fling"})["success"])
+        shell.assert_not_called()
+
+    def test_device_input_rejects_shell_injection(self):
+        bad = [
+            {"type": "key", "keycode": "4; reboot"},
+            {"type": "key", "keycode": "KEYCODE_HOME && id"},
+            {"type": "key", "keycode": True},
+            {"type": "text", "text": 123},
+            {"type": "tap", "x": float("inf"), "y": 1},
+            {"type": "swipe", "x1": 1.5e308, "y1": 0, "x2": 0, "y2": 0},
+            {"type": "tap", "x": float("nan"), "y": 1},
+        ]
+        with patch.object(server, "run_adb_shell") as shell:
+            for data in bad:
+                self.assertFalse(server._do_device_input(data)["success"], data)
+        shell.assert_not_called()
+        with patch.object(server, "run_adb_shell", return_value=(True, "", "")) as shell:
+            self.assertTrue(server._do_device_input({"type": "key", "keycode": "KEYCODE_HOME"})["success"])
+        shell.assert_called_once_with("input keyevent KEYCODE_HOME")
+
+    def test_set_proxy_validates_host(self):
+        client = server.app.test_client()
+        with patch.object(server, "API_TOKEN", ""), \
+                patch.object(server, "run_adb_shell", return_value=(True, "", "")) as shell:
+            for host in ("1.2.3.4; id", "$(id)", "-x.example.com", "a b"):
+                resp = client.post("/proxy", json={"enabled": True, "type": "http", "host": host, "port": 8080})
+                self.assertEqual(resp.status_code, 400, host)
+            self.assertEqual(client.post("/proxy", json={
+                "enabled": True, "type": "http", "host": "proxy.example.com", "port": 70000}).status_code, 400)
+            shell.assert_not_called()
+            for host in ("proxy.example.com", "10.0.0.1", "::1"):
+                resp = client.post("/proxy", json={"enabled": True, "type": "http", "host": host, "port": 8080})
+                self.assertEqual(resp.status_code, 200, host)
+
+    def test_device_input_text_is_quoted(self):
+        with patch.object(server, "run_adb_shell", return_value=(True, "", "")) as shell:
+            server._do_device_input({"type": "text", "text": "it's a test"})
+        command = shell.call_args.args[0]
+        self.assertIn("input text 'it'\"'\"'s%sa%stest'", command)
+        self.assertIn("ADB_INPUT_B64 --es msg aXQncyBhIHRlc3Q=", command)
+
+
+def _framebuffer(width, height, header=16):
+    """`screencap` raw output: LE width/height/format (+colorspace) header, RGBA pixels"""
+    pixels = bytes(v for y in range(height) for x in range(width) for v in (x, y, x ^ y, 255))
+    words = (width, height, 1, 0)[:header // 4]
+    return struct.pack("<%dI" % len(words), *words) + pixels
+
+
+@unittest.skipIf(agent_api.np is None or agent_api.imagecodecs is None, "numpy/imagecodecs not installed")
+class ScreenshotTests(unittest.TestCase):
+    def setUp(self):
+        agent_api._last_encoded = (None, None)
+
+    def _capture(self, buf, **kwargs):
+        done = subprocess.CompletedProcess([], 0, stdout=buf, stderr=b"")
+        with patch.object(agent_api.subprocess, "run", return_value=done):
+            return agent_api.capture_screenshot("png", **kwargs)
+
+    def test_framebuffer_header_sizes(self):
+        for header in (12, 16):
+            with patch.object(agent_api.subprocess, "run",
+                              return_value=subprocess.CompletedProcess([], 0, stdout=_framebuffer(4, 3, header))):
+                pixels, width, height = agent_api._read_framebuffer()
+            self.assertEqual((width, height, len(pixels)), (4, 3, 48))
+
+    def test_crop_and_encode(self):
+        image, fmt, cropped, etag = self._capture(_framebuffer(6, 5), region=(1, 2, 3, 2))
+        self.assertEqual((fmt, cropped), ("png", True))
+        frame = agent_api.imagecodecs.png_decode(image)
+        self.assertEqual(frame.shape, (2, 3, 3))
+        # Pixel (x, y) of the region is (1 + x, 2 + y) of the screen
+        self.assertEqual(frame[1, 2].tolist(), [3, 3, 3 ^ 3])
+        self.assertEqual(frame[0, 0].tolist(), [1, 2, 1 ^ 2])
+
+    def test_unchanged_frame_reuses_encoding(self):
+        first = self._capture(_framebuffer(4, 4))
+        with patch.object(agent_api, "encode_frame") as encode:
+            second = self._capture(_framebuffer(4, 4))
+        encode.assert_not_called()
+        self.assertEqual(first, second)
+
+    def test_etag_not_modified(self):
+        client = agent_api.app.test_client()
+        frames = [_framebuffer(4, 4), _framebuffer(4, 4), _framebuffer(5, 4)]
+
+        def run(*args, **kwargs):
+            return subprocess.CompletedProcess([], 0, stdout=frames.pop(0), stderr=b"")
+        with patch.object(agent_api, "API_TOKEN", ""), \
+                patch.object(agent_api, "ensure_connected"), \
+                patch.object(agent_api.subprocess, "run", side_effect=run):
+            first = client.get("/screen/screenshot")
+            etag = first.headers["ETag"]
+            self.assertEqual(first.status_code, 200)
+            self.assertTrue(first.data.startswith(b"\x89PNG"))
+            # Unchanged screen: 304 with no body
+            same = client.get("/screen/screenshot", headers={"If-None-Match": etag})
+            self.assertEqual(same.status_code, 304)
+            self.assertEqual(same.data, b"")
+            changed = client.get("/screen/screenshot", headers={"If-None-Match": etag})
+            self.assertEqual(changed.status_code, 200)
+            self.assertNotEqual(changed.headers["ETag"], etag)
+
+    def test_region_outside_screen_rejected(self):
+        client = agent_api.app.test_client()
+        screen = {"width": 100, "height": 200, "density": 160, "orientation": 0, "updated_at": 0.0}
+        with patch.object(agent_api, "API_TOKEN", ""), \
+                patch.object(agent_api, "ensure_connected"), \
+                patch.object(agent_api, "get_screen_info", return_value=screen), \
+                patch.object(agent_api, "capture_screenshot") as capture:
+            for region in ({"x": 100, "y": 0}, {"x": 0, "y": 250}, {"x": -5, "y": 0},
+                           {"x": 10, "y": 10, "width": 0, "height": 10}):
+                resp = client.post("/screen/screenshot/region", json=region)
+                self.assertEqual(resp.status_code, 400, region)
+                self.assertFalse(resp.get_json()["success"])
+        capture.assert_not_called()
+
+
+class TransferTests(unittest.TestCase):
+    def setUp(self):
+        _use_fake_adb(self)
+
+    def test_stdin_upload(self):
+        dest = os.path.join(_TMP, "pushed")
+        data = os.urandom(300000)
+        success, _, _ = server.run_adb_stdin(io.BytesIO(data), "exec-in", f"cat > {dest}")
+        self.assertTrue(success)
+        with open(dest, "rb") as f:
+            self.assertEqual(f.read(), data)
+
+    def test_stdin_upload_times_out_while_copying(self):
+        # adb that never reads: the copy blocks on a full pipe until the deadline kills it
+        start = time.monotonic()
+        result = server.run_adb_stdin(io.BytesIO(bytes(8 << 20)), "exec-in", "exec sleep 30", timeout=0.5)
+        self.assertEqual(result, (False, "", "Command timed out"))
+        self.assertLess(time.monotonic() - start, 10)
+
+    def _copy(self, src):
+        dest = os.path.join(_TMP, "copied")
+        with open(dest, "wb") as out:
+            proc = subprocess.Popen(["cat"], stdin=subprocess.PIPE, stdout=out)
+            server._copy_to_pipe(src, proc.stdin)
+            proc.communicate()
+        with open(dest, "rb") as f:
+            return f.read()
+
+    def test_copy_small_upload_stays_in_memory(self):
+        data = os.urandom(1000)
+        src = tempfile.SpooledTemporaryFile(max_size=500 * 1024)
+        src.write(data)
+        src.seek(0)
+        with patch.object(tempfile.SpooledTemporaryFile, "fileno", side_effect=AssertionError("spilled")), \
+                patch.object(server.os, "sendfile") as sendfile:
+            self.assertEqual(self._copy(src), data)
+        sendfile.assert_not_called()
+
+    def test_copy_large_file_uses_sendfile(self):
+        data = os.urandom(server._SENDFILE_MIN + 7)
+        with tempfile.TemporaryFile() as src:
+            src.write(data)
+            src.seek(5)
+            with patch.object(server.os, "sendfile", wraps=os.sendfile) as sendfile:
+                self.assertEqual(self._copy(src), data[5:])
+        sendfile.assert_called()
+
+    def _envelope(self, stream, first, **kwargs):
+        close = Mock()
+        body = b"".join(server._stream_base64_json(stream, close, first, "content_base64", {"path": "/f"}, **kwargs))
+        close.assert_called_once()
+        return json.loads(body)
+
+    def test_base64_envelope(self):
+        data = os.urandom(server._STREAM_CHUNK * 2 + 5)
+        result = self._envelope(io.BytesIO(data[10:]), data[:10], expected_size=len(data))
+        self.assertEqual(result["path"], "/f")
+        self.assertEqual(base64.b64decode(result["content_base64"]), data)
+        self.assertEqual((result["size"], result["success"]), (len(data), True))
+        self.assertNotIn("error", result)
+
+    def test_base64_envelope_short_read(self):
+        result = self._envelope(io.BytesIO(b"abc"), b"", expected_size=10)
+        self.assertFalse(result["success"])
+        self.assertEqual(result["error"], "short read: 0 of 10 bytes")
+
+    def test_base64_envelope_read_error(self):
+        stream = Mock()
+        stream.read.side_effect = OSError("connection reset")
+        result = self._envelope(stream, b"abc")
+        self.assertEqual(base64.b64decode(result["content_base64"]), b"abc")
+        self.assertEqual((result["size"], result["success"]), (3, False))
+        self.assertIn("connection reset", result["error"])
+
+
+class ScreenInfoTests(unittest.TestCase):
+    def test_shell_screen_command_invalidates_cache_after_boot(self):
+        # Container booted 10s ago: monotonic() is still far below the 60s TTL
+        screen = dict(agent_api._screen_cache, width=1080, height=2400, updated_at=5.0)
+        out = "Physical size: 720x1280\n---\nPhysical density: 320\n---\nmCurrentOrientation=0"
+        client = agent_api.app.test_client()
+        with patch.dict(agent_api._screen_cache, screen), \
+                patch.object(agent_api, "API_TOKEN", ""), \
+                patch.object(agent_api.time, "monotonic", return_value=10.0), \
+                patch.object(agent_api, "adb_shell", return_value=(True, out, "")):
+            self.assertEqual(agent_api.get_screen_info()["width"], 1080)
+            client.post("/shell", json={"command": "wm size 720x1280"})
+            self.assertEqual(agent_api.get_screen_info()["width"], 720)
+
+
+class WaitIdleTests(unittest.TestCase):
+    def _run(self, busy_polls, timeout):
+        """Run _WAIT_IDLE_SCRIPT against a dumpsys that reports a transition busy_polls times"""
+        bin_dir = tempfile.mkdtemp(dir=_TMP)
+        with open(os.path.join(bin_dir, "dumpsys"), "w") as f:
+            f.write("#!/bin/sh\n"
+                    f"n=$(cat {bin_dir}/n 2>/dev/null || echo 0); echo $((n + 1)) > {bin_dir}/n\n"
+                    f"[ $n -lt {busy_polls} ] && echo '  mAppTransitionState=APP_STATE_RUNNING'\n"
+                    "echo '  mCurrentFocus=Window{1 u0 launcher}'\n")
+        os.chmod(os.path.join(bin_dir, "dumpsys"), 0o755)
+        env = dict(os.environ, PATH=bin_dir + os.pathsep + os.environ["PATH"])
+        script = agent_api._WAIT_IDLE_SCRIPT.format(timeout=timeout)
+        start = time.monotonic()
+        rc = subprocess.run(["sh", "-c", script], env=env, timeout=timeout + 5).returncode
+        with open(os.path.join(bin_dir, "n")) as f:
+            return rc, int(f.read()), time.monotonic() - start
+
+    def test_returns_once_idle(self):
+        rc, polls, _ = self._run(busy_polls=3, timeout=5)
+        self.assertEqual((rc, polls), (0, 4))
+
+    def test_gives_up_at_deadline(self):
+        rc, polls, elapsed = self._run(busy_polls=1000, timeout=1)
+        self.assertEqual(rc, 1)
+        # Backed-off polling: a handful of dumpsys runs, not one per 100ms
+        self.assertLess(polls, 8)
+        self.assertLess(elapsed, 4)
+
+    def test_timeout_capped_and_run_outside_session(self):
+        client = agent_api.app.test_client()
+        with patch.object(agent_api, "API_TOKEN", ""), \
+                patch.object(agent_api, "ensure_connected"), \
+                patch.object(agent_api, "adb_shell") as shell, \
+                patch.object(agent_api, "adb", return_value=(True, "", "")) as adb:
+            resp = client.post("/wait/idle", json={"timeout": 3600})
+        self.assertTrue(resp.get_json()["data"]["idle"])
+        shell.assert_not_called()
+        self.assertEqual(adb.call_args.kwargs["timeout"], agent_api.DEFAULT_TIMEOUT + 5)
+
+
+def _read_service(conn):
+    """One adb smart-socket request: 4 hex digits of length, then the service name"""
+    return server._recv_exact(conn, int(server._recv_exact(conn, 4), 16)).decode()
+
+
+class ExecOutTests(unittest.TestCase):
+    def _serve(self, handler):
+        """Listen as the adb server; handler(conn, services) answers each connection"""
+        srv = socket.socket()
+        srv.bind(("127.0.0.1", 0))
+        srv.listen(4)
+        self.addCleanup(srv.close)
+        services = []
+
+        def serve():
+            while True:
+                try:
+                    conn, _ = srv.accept()
+                except OSError:
+                    return
+                with conn:
+                    handler(conn, services)
+        threading.Thread(target=serve, daemon=True).start()
+        for patcher in (patch.object(server, "ADB_SERVER_PORT", srv.getsockname()[1]),
+                        patch.object(server, "_transport_id", None)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        return services
+
+    def test_smart_socket_framing(self):
+        def handler(conn, services):
+            for _ in range(2):
+                services.append(_read_service(conn))
+                conn.sendall(b"OKAY")
+            conn.sendall(b"payload bytes")
+        services = self._serve(handler)
+        stream, close = server._exec_out("screencap -p")
+        try:
+            self.assertEqual(stream.read(), b"payload bytes")
+        finally:
+            close()
+        self.assertEqual(services, [f"host:transport:{server.ADB_CONNECT}", "exec:screencap -p"])
+
+        with patch.object(server, "_transport_id", "7"):
+            stream, close = server._exec_out("true")
+            close()
+        self.assertEqual(services[2], "host:transport-id:7")
+
+    def test_server_failure_falls_back_to_adb_binary(self):
+        def handler(conn, services):
+            services.append(_read_service(conn))
+            conn.sendall(b"FAIL%04xdevice offline" % len("device offline"))
+        self._serve(handler)
+        _use_fake_adb(self)
+        stream, close = server._exec_out("echo from-binary")
+        try:
+            self.assertEqual(stream.read(), b"from-binary\n")
+        finally:
+            close()
+        self.assertEqual(server._state["last_adb_error"], "device offline")
+
+    def test_first_read_timeout_is_504(self):
+        def handler(conn, services):
+            for _ in range(2):
+                services.append(_read_service(conn))
+                conn.sendall(b"OKAY")
+            time.sleep(2)  # device never answers
+        self._serve(handler)
+        exec_out = server._exec_out
+        client = server.app.test_client()
+        with patch.object(server, "API_TOKEN", ""), \
+                patch.object(server, "ensure_adb_connected"), \
+                patch.object(server, "_exec_out", lambda command: exec_out(command, timeout=0.3)):
+            resp = client.get("/device/screenshot")
+        self.assertEqual(resp.status_code, 504)
+        self.assertEqual(resp.get_json()["error"], "Command timed out")
+
+
+def _luhn_valid(number):
+    total = 0
+    for i, d in enumerate(reversed(number)):
+        d = int(d)
+        if i % 2:
+            d = d * 2 - 9 if d > 4 else d * 2
+        total += d
+    return total % 10 == 0
+
+
+class IdentityTests(unittest.TestCase):
+    def test_generate_imei_luhn(self):
+        for _ in range(200):
+            imei = server.generate_imei()
+            self.assertRegex(imei, r"^35\d{13}$")
+            self.assertTrue(_luhn_valid(imei), imei)
+
+    def test_generate_serial(self):
+        serials = {server.generate_serial() for _ in range(50)}
+        self.assertEqual(len(serials), 50)
+        for serial in serials:
+            self.assertRegex(serial, r"^[0-9A-HJ-NP-Z]{11}$")
+
+    def test_generated_ids_returned_as_stored(self):
+        client = server.app.test_client()
+        with patch.object(server, "API_TOKEN", ""):
+            resp = client.post("/device/identity/generate")
+        self.assertEqual(resp.get_json()["hardware_ids"], server._device_state["hardware_ids"])
+
+
+class AppListTests(unittest.TestCase):
+    def test_refresh_apps_parses_package_lines(self):
+        out = "package:com.example.a\npackage:org.example.b\nWARNING: linker noise\n"
+        with patch.dict(server._apps_cache), \
+                patch.object(server, "run_adb_shell", return_value=(True, out, "")):
+            self.assertEqual(server._refresh_apps(), (True, ["com.example.a", "org.example.b"]))
+            self.assertEqual(server._apps_cache["val"], ["com.example.a", "org.example.b"])
+
+
+class FileReadTests(unittest.TestCase):
+    def setUp(self):
+        _use_fake_adb(self)
+
+    def _read(self, path):
+        return json.loads(b"".join(agent_api.stream_file_base64(path)))
+
+    def test_base64_envelope(self):
+        path = os.path.join(_TMP, "read me")
+        data = os.urandom(agent_api._B64_CHUNK * 3 + 1)
+        with open(path, "wb") as f:
+            f.write(data)
+        result = self._read(path)
+        self.assertEqual(base64.b64decode(result["data"]["content"]), data)
+        self.assertEqual((result["data"]["size"], result["success"], result["error"]), (len(data), True, None))
+
+    def test_missing_file(self):
+        result = self._read(os.path.join(_TMP, "missing"))
+        self.assertFalse(result["success"])
+        self.assertIn("No such file", result["error"])
+
+    def test_slow_device_is_not_idle(self):
+        fifo = os.path.join(_TMP, "trickle")
+        os.mkfifo(fifo)
+        self.addCleanup(os.unlink, fifo)
+
+        def trickle():
+            # 10 small writes over ~2.5s, each well inside the 1s idle timeout
+            with open(fifo, "wb", buffering=0) as f:
+                for i in range(10):
+                    f.write(b"%02d" % i)
+                    time.sleep(0.25)
+        writer = threading.Thread(target=trickle)
+        writer.start()
+        self.addCleanup(writer.join)
+        with patch.object(agent_api, "DEFAULT_TIMEOUT", 1):
+            result = self._read(fifo)
+        self.assertTrue(result["success"], result["error"])
+        self.assertEqual(base64.b64decode(result["data"]["content"]), b"".join(b"%02d" % i for i in range(10)))
+
+    def test_idle_device_times_out(self):
+        fifo = os.path.join(_TMP, "stalled")
+        os.mkfifo(fifo)
+        self.addCleanup(os.unlink, fifo)
+        # Holds the write end open: a few bytes arrive, then nothing
+        fd = os.open(fifo, os.O_RDWR | os.O_NONBLOCK)
+        os.write(fd, b"abcd")
+        # Ends the read regardless, so a broken watchdog fails instead of hanging
+        closer = threading.Timer(8, os.close, (fd,))
+        closer.start()
+
+        def cleanup():
+            closer.cancel()
+            closer.join()
+            try:
+                os.close(fd)
+            except OSError:
+                pass  # already closed by the timer
+        self.addCleanup(cleanup)
+        with patch.object(agent_api, "DEFAULT_TIMEOUT", 1):
+            start = time.monotonic()
+            result = self._read(fifo)
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual(base64.b64decode(result["data"]["content"]), b"abcd")
+        self.assertEqual((result["success"], result["error"]), (False, "Command timed out"))
+
+
+if __name__ == "__main__":
+    unittest.main()
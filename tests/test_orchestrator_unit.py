@@ -54,6 +54,44 @@ class OrchestratorUnitTests(unittest.TestCase):
         self.assertEqual(len(result), 4)
         self.assertEqual(mock_post.call_count, 4)
 
+    @patch("orchestrator.server._session")
+    def test_control_calls_use_shared_session(self, mock_session):
+        mock_session.get.return_value.json.return_value = {"status": "healthy"}
+        mock_session.post.return_value.json.return_value = {"success": True}
+        self.assertEqual(orch._control_get("http://mock", "/health"), {"status": "healthy"})
+        self.assertEqual(orch._control_post("http://mock", "/device/input", {"type": "tap"}), {"success": True})
+        mock_session.get.assert_called_once()
+        self.assertEqual(mock_session.post.call_args[0][0], "http://mock/device/input")
+
+    @patch("orchestrator.server._control_get_raw")
+    def test_cached_control_get_raw(self, mock_get):
+        raw = (b'{"status": "healthy"}', "application/json")
+        mock_get.return_value = raw
+        orch._status_cache.clear()
+        for _ in range(3):
+            self.assertEqual(orch._cached_control_get_raw("http://mock", "/health"), raw)
+        self.assertEqual(mock_get.call_count, 1)
+        orch._status_cache[("http://mock", "/health")] = (0.0, (b"{}", "application/json"))
+        self.assertEqual(orch._cached_control_get_raw("http://mock", "/health"), raw)
+        self.assertEqual(mock_get.call_count, 2)
+
+    @patch("orchestrator.server._session")
+    def test_phone_screenshot_png_streams(self, mock_session):
+        upstream = mock_session.get.return_value
+        upstream.headers = {"Content-Type": "image/png"}
+        upstream.iter_content.return_value = iter([b"\x89PNG", b"rest"])
+        orch._instances.clear()
+        inst = orch._create_instance_record("http://mock", "one")
+        try:
+            resp = orch.app.test_client().get(f"/phones/{inst['id']}/screenshot.png")
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.mimetype, "image/png")
+            self.assertEqual(resp.data, b"\x89PNGrest")
+            self.assertTrue(mock_session.get.call_args[1]["stream"])
+            upstream.close.assert_called()
+        finally:
+            orch._instances.clear()
+
     def test_run_steps_invalid_action(self):
         steps = [{"action": "unknown"}]
         with self.assertRaises(ValueError):
@@ -84,6 +122,24 @@ class OrchestratorUnitTests(unittest.TestCase):
         finally:
             orch.ORCH_MAX_INSTANCES = orig
 
+    def test_bulk_provision_respects_limit(self):
+        orig = orch.ORCH_MAX_INSTANCES
+        try:
+            orch.ORCH_MAX_INSTANCES = 2
+            orch._instances.clear()
+            client = orch.app.test_client()
+            resp = client.post("/instances/bulk", json={"count": 2})
+            self.assertEqual(resp.status_code, 201)
+            self.assertEqual(len(resp.get_json()["instances"]), 2)
+            self.assertEqual(len(orch._instances), 2)
+            resp = client.post("/instances/bulk", json={"count": 1})
+            self.assertEqual(resp.status_code, 500)
+            self.assertIn("Instance limit reached", resp.get_json()["errors"][0])
+            self.assertEqual(client.post("/instances/bulk", json={"count": 3}).status_code, 400)
+        finally:
+            orch.ORCH_MAX_INSTANCES = orig
+            orch._instances.clear()
+
     def test_normalize_steps_validation(self):
         steps = [{"action": "start_app", "package": "com.app"}]
         self.assertEqual(orch._normalize_steps(steps), steps)
@@ -100,6 +156,11 @@ class OrchestratorUnitTests(unittest.TestCase):
         self.assertFalse(orch._is_lease_valid("id1", owner="owner2"))
         orch._clear_lease("id1")
         self.assertFalse(orch._is_lease_valid("id1"))
+        self.assertTrue(orch._try_lease("id1", "owner1", 30))
+        self.assertFalse(orch._try_lease("id1", "owner2", 30))
+        orch._leases["id1"]["expires_at"] = 0
+        self.assertTrue(orch._try_lease("id1", "owner2", 30))
+        self.assertTrue(orch._is_lease_valid("id1", owner="owner2"))
 
 
 if __name__ == "__main__":